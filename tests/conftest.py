@@ -0,0 +1,27 @@
+import os
+
+import pytest
+import sqlalchemy as sql
+
+from migrate import run_migrations
+
+# Tests marked with the `pg_engine` fixture need a throwaway Postgres database,
+# e.g. TEST_POSTGRES_URI=postgresql://postgres@localhost/moodfit_test
+TEST_POSTGRES_URI = os.environ.get("TEST_POSTGRES_URI")
+
+
+@pytest.fixture(scope="session")
+def pg_engine() -> sql.Engine:
+    if not TEST_POSTGRES_URI:
+        pytest.skip("TEST_POSTGRES_URI is not set")
+    engine = sql.create_engine(TEST_POSTGRES_URI)
+
+    @sql.event.listens_for(engine, "connect")
+    def set_session_defaults(dbapi_connection, connection_record):
+        # A local time zone must not change the results
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute("SET TimeZone = 'Europe/Berlin'")
+        dbapi_connection.commit()
+
+    run_migrations(engine)
+    return engine
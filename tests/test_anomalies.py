@@ -0,0 +1,147 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import anomalies
+from anomalies import (
+    MAX_SEGMENT_DAYS,
+    Z_SCORE_WINDOW,
+    AnomalyTracker,
+    OnlineAnomalyDetector,
+    detect_change_points,
+    find_anomalies,
+    robust_z_scores,
+)
+from db import add_diary_records_bulk
+
+TEST_USER_ID = "pytest-anomalies"
+
+
+def get_records(start: date, sleep: list[float]) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    days = len(sleep)
+    return pd.DataFrame(
+        {
+            "date": pd.date_range(start, periods=days),
+            "sleep": sleep,
+            "bodybattery_min": rng.normal(20, 3, days).round(),
+            "bodybattery_max": rng.normal(75, 3, days).round(),
+            "steps": rng.normal(5000, 300, days).round(),
+            "body": rng.integers(2, 5, days),
+            "psyche": rng.integers(2, 5, days),
+            "dizzy": rng.random(days) < 0.3,
+        }
+    )
+
+
+def get_sleep(*levels: tuple[float, int]) -> list[float]:
+    rng = np.random.default_rng(1)
+    return [level + rng.normal(0, 0.3) for level, days in levels for _ in range(days)]
+
+
+def test_detect_change_points_finds_a_shift_of_the_mean():
+    values = np.array(get_sleep((6, 30), (9, 30)))
+
+    assert detect_change_points(values) == [30]
+    assert detect_change_points(values[:30]) == []
+
+
+def test_robust_z_scores_flag_a_single_outlier():
+    values = np.array(get_sleep((7, 40)))
+    values[35] = 14
+
+    z_scores, medians = robust_z_scores(values)
+
+    assert np.isnan(z_scores[: Z_SCORE_WINDOW // 2]).all()
+    assert z_scores[35] > 3.5
+    assert np.nanargmax(np.abs(z_scores)) == 35
+    assert medians[35] == pytest.approx(7, abs=0.3)
+
+
+def test_find_anomalies_reports_a_shift():
+    df = get_records(date(2024, 1, 1), get_sleep((6, 40), (9, 40)))
+
+    df_shifts, _ = find_anomalies(df.sample(frac=1, random_state=0))
+
+    sleep_shifts = df_shifts[
+        (df_shifts["metric"] == "Schlafzeit") & (df_shifts["after"] > 8)
+    ]
+    assert len(sleep_shifts) == 1
+    shift_date = sleep_shifts["date"].iloc[0]
+    assert abs(shift_date - pd.Timestamp("2024-02-10")) <= pd.Timedelta(days=3)
+    assert sleep_shifts["before"].iloc[0] < 6.5
+
+
+def test_find_anomalies_reports_an_outlier():
+    sleep = get_sleep((7, 60))
+    sleep[40] = 14
+    df = get_records(date(2024, 1, 1), sleep)
+
+    _, df_outliers = find_anomalies(df)
+
+    sleep_outliers = df_outliers[df_outliers["metric"] == "Schlafzeit"]
+    outlier = sleep_outliers.loc[sleep_outliers["z_score"].idxmax()]
+    assert outlier["date"] == pd.Timestamp("2024-02-10")
+    assert outlier["value"] == 14
+    assert outlier["median"] == pytest.approx(7, abs=0.3)
+
+
+def test_online_detector_confirms_a_shift_after_min_segment_days():
+    df = get_records(date(2024, 1, 1), get_sleep((6, 40), (9, 40)))
+    detector = OnlineAnomalyDetector(df.iloc[:40])
+
+    confirmed = {}
+    for record in df.iloc[40:].to_dict("records"):
+        record["date"] = record["date"].date()
+        shifts, _ = detector.update(record)
+        for shift in shifts:
+            if shift["metric"] == "Schlafzeit" and shift["after"] > 8:
+                confirmed[record["date"]] = shift["date"]
+
+    assert confirmed == {date(2024, 2, 16): date(2024, 2, 10)}
+    assert detector.last_date == date(2024, 3, 20)
+    with pytest.raises(ValueError):
+        detector.update({"date": date(2024, 3, 20)})
+
+
+@pytest.fixture
+def anomaly_user(pg_engine):
+    records = get_records(date(2024, 1, 1), get_sleep((7, 500)))
+    records["date"] = records["date"].dt.strftime("%Y-%m-%d")
+    records["tasks"] = [[] for _ in range(len(records))]
+    records["comment"] = ""
+    add_diary_records_bulk(records.to_dict("records"), TEST_USER_ID, pg_engine)
+    yield TEST_USER_ID
+    with pg_engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM diary WHERE user_id = %s", (TEST_USER_ID,))
+
+
+def test_tracker_reads_only_the_window_before_the_record(
+    pg_engine, anomaly_user, monkeypatch
+):
+    read_ranges = []
+    read_records = anomalies.get_diary_records_by_date_range
+
+    def record_range(start_date, end_date, user_id, sql_engine):
+        read_ranges.append((start_date, end_date))
+        return read_records(start_date, end_date, user_id, sql_engine)
+
+    monkeypatch.setattr(anomalies, "get_diary_records_by_date_range", record_range)
+    tracker = AnomalyTracker()
+    newest = date(2024, 1, 1) + timedelta(days=500)
+
+    _, outliers = tracker.update({"date": newest, "sleep": 20}, anomaly_user, pg_engine)
+    tracker.update({"date": newest + timedelta(days=1)}, anomaly_user, pg_engine)
+    # A change of the past reads the window before it, the next new day reads again
+    tracker.update({"date": date(2024, 6, 1)}, anomaly_user, pg_engine)
+    tracker.update({"date": newest + timedelta(days=2)}, anomaly_user, pg_engine)
+
+    window = timedelta(days=MAX_SEGMENT_DAYS + Z_SCORE_WINDOW)
+    assert read_ranges == [
+        (newest - window, newest - timedelta(days=1)),
+        (date(2024, 6, 1) - window, date(2024, 5, 31)),
+        (newest + timedelta(days=2) - window, newest + timedelta(days=1)),
+    ]
+    assert [outlier["metric"] for outlier in outliers] == ["Schlafzeit"]
@@ -0,0 +1,90 @@
+import json
+import threading
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from api import DiaryRequestHandler
+from db import add_diary_records_bulk
+from mock_db import get_random_entries
+from routing import EngineRouter
+
+AUTH_USER_HEADER = "X-Forwarded-User"
+
+
+@pytest.fixture
+def api_server(monkeypatch):
+    def start(engine_router):
+        monkeypatch.setattr(
+            DiaryRequestHandler, "engine_router", engine_router, raising=False
+        )
+        monkeypatch.setattr(
+            DiaryRequestHandler, "auth_user_header", AUTH_USER_HEADER, raising=False
+        )
+        server = ThreadingHTTPServer(("127.0.0.1", 0), DiaryRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address[1]
+
+    servers: list[ThreadingHTTPServer] = []
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def _get(port, path, headers=None):
+    conn = HTTPConnection("127.0.0.1", port)
+    conn.request("GET", path, headers=headers or {})
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def test_requests_without_user_are_rejected(api_server):
+    port = api_server(engine_router=None)
+
+    response, body = _get(port, "/diary?user=default")
+
+    assert response.status == 401
+    assert json.loads(body) == {"error": "Not authenticated"}
+
+
+@pytest.fixture
+def api_users(pg_engine):
+    add_diary_records_bulk(get_random_entries(10), "pytest-api-anna", pg_engine)
+    add_diary_records_bulk(get_random_entries(5), "pytest-api-ben", pg_engine)
+    yield
+    with pg_engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM diary WHERE user_id LIKE 'pytest-api-%%'")
+
+
+def test_diary_of_the_authenticated_user_only(api_server, pg_engine, api_users):
+    port = api_server(engine_router=EngineRouter(pg_engine, []))
+    headers = {AUTH_USER_HEADER: "pytest-api-ben"}
+
+    response, body = _get(port, "/diary?user=pytest-api-anna&start=2000-01-01", headers)
+    etag = response.getheader("ETag")
+    not_modified, _ = _get(
+        port,
+        "/diary?user=pytest-api-anna&start=2000-01-01",
+        {**headers, "If-None-Match": etag},
+    )
+
+    assert response.status == 200
+    assert len(json.loads(body)) == 5
+    assert AUTH_USER_HEADER in response.getheader("Vary")
+    assert not_modified.status == 304
+
+
+@pytest.mark.parametrize("interval", ["0days", "3weeks", "999999999days"])
+def test_invalid_intervals_are_rejected(api_server, interval):
+    port = api_server(engine_router=None)
+
+    response, body = _get(
+        port,
+        f"/diary/intervals?interval={interval}",
+        headers={AUTH_USER_HEADER: "pytest-api-anna"},
+    )
+
+    assert response.status == 400
+    assert "interval" in json.loads(body)["error"]
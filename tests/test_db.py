@@ -0,0 +1,254 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+import sqlalchemy as sql
+
+import db
+from db import (
+    _read_sql_as_arrow,
+    add_diary_records_bulk,
+    create_sqlite_comment_search,
+    get_diary_records_as_df,
+    search_diary_comments,
+)
+from mock_db import get_random_entries
+
+TEST_USER_ID = "pytest-db"
+
+
+@pytest.fixture
+def diary_user(pg_engine):
+    records = get_random_entries(60)
+    records[0]["tasks"] = []
+    records[1]["tasks"] = None
+    records[2]["comment"] = 'Zeile 1\nZeile "2", mit Komma'
+    add_diary_records_bulk(records, TEST_USER_ID, pg_engine)
+    yield TEST_USER_ID
+    with pg_engine.begin() as conn:
+        conn.execute(
+            sql.text("DELETE FROM diary WHERE user_id = :user_id"),
+            {"user_id": TEST_USER_ID},
+        )
+
+
+def test_arrow_read_matches_read_sql_query(pg_engine, diary_user):
+    query = sql.text("SELECT * FROM diary WHERE user_id = :user_id ORDER BY date DESC")
+    params = {"user_id": diary_user}
+
+    df_arrow = get_diary_records_as_df(diary_user, pg_engine)
+    with pg_engine.connect() as conn:
+        df_rows = pd.read_sql_query(query, conn, params=params)
+
+    df_rows = df_rows.set_index("date").sort_index()
+    df_arrow = df_arrow.set_index(df_arrow["date"].dt.date).sort_index()
+    assert len(df_arrow) == len(df_rows) == 60
+    for column in ["sleep", "steps", "body", "psyche", "dizzy", "comment"]:
+        assert df_arrow[column].tolist() == df_rows[column].tolist(), column
+    assert df_arrow["tasks"].tolist() == df_rows["tasks"].tolist()
+    assert df_arrow["modified_at"].tolist() == (
+        pd.to_datetime(df_rows["modified_at"], utc=True).tolist()
+    )
+    assert all(isinstance(tasks, (list, type(None))) for tasks in df_arrow["tasks"])
+
+
+def test_arrow_read_streams_in_batches(pg_engine, diary_user, monkeypatch):
+    monkeypatch.setattr(db, "COPY_BLOCK_SIZE", 128)
+
+    table = _read_sql_as_arrow(
+        sql.text("SELECT date, tasks FROM diary WHERE user_id = :user_id"),
+        {"user_id": diary_user},
+        pg_engine,
+    )
+
+    assert table.num_rows == 60
+    assert table["date"].num_chunks > 1
+    assert table.schema.field("date").type == "date32[day]"
+
+
+def test_arrow_read_raises_query_errors(pg_engine):
+    with pytest.raises(Exception, match="no_such_column"):
+        _read_sql_as_arrow(sql.text("SELECT no_such_column FROM diary"), {}, pg_engine)
+    # The engine stays usable after the failed copy
+    with pg_engine.connect() as conn:
+        assert conn.execute(sql.text("SELECT 1")).scalar_one() == 1
+
+
+def test_get_postgres_uri_reads_the_env_file_on_the_first_call(tmp_path, monkeypatch):
+    (tmp_path / ".env").write_text(
+        "PG_URI=postgresql://postgres@localhost/moodfit_test\nPG_REPLICA_MAX_LAG=2\n"
+    )
+    monkeypatch.chdir(tmp_path)
+    for name in ["PG_URI", "PG_REPLICA_MAX_LAG"]:
+        # Registers the variable, so that the value from the .env is undone
+        monkeypatch.setenv(name, "")
+        monkeypatch.delenv(name)
+
+    db_config = db.get_postgres_uri()
+
+    assert db_config == {
+        "uri": "postgresql://postgres@localhost/moodfit_test",
+        "replica_uris": [],
+        "max_replica_lag": 2.0,
+    }
+    assert db.get_postgres_uri() == db_config
+
+
+def test_get_df_with_interval_col_counts_from_the_first_date():
+    df = pd.DataFrame(
+        {"date": pd.to_datetime(["2024-01-03", "2024-01-01", "2024-01-07"])}
+    )
+
+    df = db.get_df_with_interval_col(df, interval="3days")
+
+    assert df["date_interval"].tolist() == [0, 0, 2]
+    with pytest.raises(ValueError):
+        db.get_df_with_interval_col(pd.DataFrame({"day": []}))
+
+
+def test_get_interval_aggregates():
+    df = pd.DataFrame(
+        {
+            "date": pd.date_range("2024-01-01", periods=5),
+            "sleep": [6.0, 8.0, None, 7.0, 9.0],
+            "bodybattery_min": [10, 20, 30, 40, 50],
+            "bodybattery_max": [60, 70, 80, 90, 100],
+            "bodybattery_range": [50, 50, 50, 50, 50],
+            "steps": [1000, 2000, 3000, 4000, 5000],
+            "body": [1, 2, 3, 4, 5],
+            "psyche": [5, 4, 3, 2, 1],
+            "dizzy": [True, None, False, True, True],
+            "task_load": [0, 1, 2, 3, 4],
+        }
+    )
+
+    df_aggregates = db.get_interval_aggregates(df, interval="3days")
+
+    assert df_aggregates["date_interval"].tolist() == [0, 1]
+    assert df_aggregates["records"].tolist() == [3, 2]
+    assert df_aggregates["end_date"].tolist() == list(
+        pd.to_datetime(["2024-01-03", "2024-01-05"])
+    )
+    # Missing values are left out of the means, unanswered days are not dizzy
+    assert df_aggregates["sleep"].tolist() == [7.0, 8.0]
+    assert df_aggregates["dizzy_days"].tolist() == [1, 2]
+    assert df_aggregates["steps"].tolist() == [2000, 4500]
+
+
+@pytest.fixture
+def sqlite_engine():
+    engine = sql.create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE diary (date DATE, user_id TEXT, comment TEXT)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO diary VALUES ('2024-01-01', 'anna', 'Kopfschmerz am Abend')"
+        )
+    return engine
+
+
+def _add_comment(sql_engine, day, user_id, comment):
+    with sql_engine.begin() as conn:
+        conn.execute(
+            sql.text("INSERT INTO diary VALUES (:date, :user_id, :comment)"),
+            {"date": day, "user_id": user_id, "comment": comment},
+        )
+
+
+def test_sqlite_comment_search_indexes_existing_and_new_comments(sqlite_engine):
+    create_sqlite_comment_search(sqlite_engine)
+    _add_comment(sqlite_engine, "2024-01-02", "anna", "Wieder Kopfschmerz, müde")
+
+    results = search_diary_comments("kopfschmerz", "anna", sqlite_engine)
+
+    assert sorted(result["date"] for result in results) == [
+        date(2024, 1, 1),
+        date(2024, 1, 2),
+    ]
+    assert "**Kopfschmerz**" in results[0]["snippet"]
+    # Diacritics are removed from the index and the query
+    assert len(search_diary_comments("MUDE", "anna", sqlite_engine)) == 1
+
+
+def test_sqlite_comment_search_follows_updates_and_deletions(sqlite_engine):
+    create_sqlite_comment_search(sqlite_engine)
+    with sqlite_engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE diary SET comment = 'Schwindel' WHERE true")
+
+    assert search_diary_comments("kopfschmerz", "anna", sqlite_engine) == []
+    assert len(search_diary_comments("schwindel", "anna", sqlite_engine)) == 1
+
+    with sqlite_engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM diary")
+
+    assert search_diary_comments("schwindel", "anna", sqlite_engine) == []
+
+
+def test_sqlite_comment_search_finds_comments_of_the_user_only(sqlite_engine):
+    create_sqlite_comment_search(sqlite_engine)
+    _add_comment(sqlite_engine, "2024-01-01", "ben", "Kopfschmerz")
+
+    results = search_diary_comments("kopfschmerz", "ben", sqlite_engine)
+
+    assert [result["snippet"] for result in results] == ["**Kopfschmerz**"]
+
+
+@pytest.mark.parametrize(
+    "query, match_count",
+    [
+        ('Kopfschmerz"', 1),
+        ("Kopfschmerz OR", 0),
+        ("NOT Kopfschmerz", 0),
+        ("Kopf*", 0),
+        ("comment:Abend", 0),
+        ("  ", 0),
+    ],
+)
+def test_sqlite_comment_search_takes_operators_as_words(
+    sqlite_engine, query, match_count
+):
+    create_sqlite_comment_search(sqlite_engine)
+
+    # No FTS5 syntax error, operators are words which must occur as well
+    assert len(search_diary_comments(query, "anna", sqlite_engine)) == match_count
+
+
+@pytest.fixture
+def comment_user(pg_engine):
+    records = get_random_entries(3)
+    for record, comment in zip(
+        records,
+        [
+            "Starke Kopfschmerzen nach dem Training",
+            "Kopfschmerzen und Schwindel am Morgen",
+            "Gut geschlafen",
+        ],
+    ):
+        record["comment"] = comment
+    add_diary_records_bulk(records, TEST_USER_ID, pg_engine)
+    add_diary_records_bulk(records[:1], f"{TEST_USER_ID}-other", pg_engine)
+    yield TEST_USER_ID
+    with pg_engine.begin() as conn:
+        conn.execute(
+            sql.text("DELETE FROM diary WHERE user_id IN (:user_id, :other_user_id)"),
+            {"user_id": TEST_USER_ID, "other_user_id": f"{TEST_USER_ID}-other"},
+        )
+
+
+def test_postgres_comment_search_matches_word_stems_in_web_syntax(
+    pg_engine, comment_user
+):
+    results = search_diary_comments("kopfschmerz", comment_user, pg_engine)
+    excluded_results = search_diary_comments(
+        "kopfschmerz -schwindel", comment_user, pg_engine
+    )
+    phrase_results = search_diary_comments('"gut geschlafen"', comment_user, pg_engine)
+
+    assert len(results) == 2
+    assert all("**Kopfschmerzen**" in result["snippet"] for result in results)
+    assert [result["snippet"] for result in excluded_results] == [
+        "Starke **Kopfschmerzen** nach dem Training"
+    ]
+    assert len(phrase_results) == 1
+    assert search_diary_comments('kopf" OR (', comment_user, pg_engine) == []
@@ -0,0 +1,121 @@
+import json
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import diary_cache
+from diary_cache import PAYLOAD_ALL, DiaryCache
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Replaces the database reads of the cache and records their arguments."""
+    reads = []
+
+    def read_range(start_date, end_date, user_id, sql_engine):
+        reads.append((user_id, start_date, end_date))
+        return pd.DataFrame({"date": pd.date_range(start_date, end_date)})
+
+    def read_record(day, user_id, sql_engine):
+        reads.append((user_id, day))
+        return {"date": day, "sleep": 8}
+
+    monkeypatch.setattr(diary_cache, "get_diary_records_by_date_range", read_range)
+    monkeypatch.setattr(diary_cache, "get_diary_record_by_date", read_record)
+    return reads
+
+
+def test_reads_are_cached_and_returned_as_copies(reads):
+    cache = DiaryCache()
+
+    df_diary = cache.get_records_by_date_range(
+        date(2024, 1, 1), date(2024, 1, 31), "anna", None
+    )
+    df_diary["date"] = None
+    record = cache.get_record(date(2024, 1, 5), "anna", None)
+    record["sleep"] = 0
+
+    assert (
+        cache.get_records_by_date_range(
+            date(2024, 1, 1), date(2024, 1, 31), "anna", None
+        )["date"]
+        .notna()
+        .all()
+    )
+    assert cache.get_record(date(2024, 1, 5), "anna", None)["sleep"] == 8
+    assert len(reads) == 2
+
+
+def test_invalidate_drops_only_entries_containing_the_date(reads):
+    cache = DiaryCache()
+    january = (date(2024, 1, 1), date(2024, 1, 31))
+    february = (date(2024, 2, 1), date(2024, 2, 29))
+    for user_id in ["anna", "ben"]:
+        cache.get_records_by_date_range(*january, user_id, None)
+        cache.get_records_by_date_range(*february, user_id, None)
+    cache.get_record(date(2024, 1, 15), "anna", None)
+    reads.clear()
+
+    cache.invalidate("anna", date(2024, 1, 15))
+    for user_id in ["anna", "ben"]:
+        cache.get_records_by_date_range(*january, user_id, None)
+        cache.get_records_by_date_range(*february, user_id, None)
+    cache.get_record(date(2024, 1, 15), "anna", None)
+
+    assert reads == [("anna", *january), ("anna", date(2024, 1, 15))]
+
+
+def test_read_during_an_invalidation_is_not_cached(reads, monkeypatch):
+    cache = DiaryCache()
+    read_range = diary_cache.get_diary_records_by_date_range
+
+    def read_range_during_write(start_date, end_date, user_id, sql_engine):
+        df_diary = read_range(start_date, end_date, user_id, sql_engine)
+        # The write commits after the read, but before the result is cached
+        cache.invalidate(user_id, start_date)
+        return df_diary
+
+    monkeypatch.setattr(
+        diary_cache, "get_diary_records_by_date_range", read_range_during_write
+    )
+    cache.get_records_by_date_range(date(2024, 1, 1), date(2024, 1, 31), "anna", None)
+    monkeypatch.setattr(diary_cache, "get_diary_records_by_date_range", read_range)
+    cache.get_records_by_date_range(date(2024, 1, 1), date(2024, 1, 31), "anna", None)
+
+    assert len(reads) == 2
+
+
+def test_handle_notification_invalidates_and_notifies(reads):
+    cache = DiaryCache()
+    notifications = []
+    cache.subscribe(lambda user_id, day: notifications.append((user_id, day)))
+    cache.get_records_by_date_range(date(2024, 1, 1), date(2024, 1, 31), "anna", None)
+    cache.get_records_by_date_range(date(2024, 1, 1), date(2024, 1, 31), "ben", None)
+    reads.clear()
+
+    cache.handle_notification(json.dumps({"user_id": "anna", "date": "2024-01-10"}))
+    cache.get_records_by_date_range(date(2024, 1, 1), date(2024, 1, 31), "ben", None)
+    cache.handle_notification(PAYLOAD_ALL)
+    cache.get_records_by_date_range(date(2024, 1, 1), date(2024, 1, 31), "ben", None)
+
+    assert notifications == [("anna", date(2024, 1, 10)), (None, None)]
+    assert reads == [("ben", date(2024, 1, 1), date(2024, 1, 31))]
+
+
+def test_least_recently_used_ranges_are_dropped(reads, monkeypatch):
+    monkeypatch.setattr(diary_cache, "MAX_CACHED_RANGES", 2)
+    cache = DiaryCache()
+    january = (date(2024, 1, 1), date(2024, 1, 31))
+    february = (date(2024, 2, 1), date(2024, 2, 29))
+    march = (date(2024, 3, 1), date(2024, 3, 31))
+
+    cache.get_records_by_date_range(*january, "anna", None)
+    cache.get_records_by_date_range(*february, "anna", None)
+    cache.get_records_by_date_range(*january, "anna", None)
+    cache.get_records_by_date_range(*march, "anna", None)
+    reads.clear()
+    cache.get_records_by_date_range(*january, "anna", None)
+    cache.get_records_by_date_range(*february, "anna", None)
+
+    assert reads == [("anna", *february)]
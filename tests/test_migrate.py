@@ -0,0 +1,121 @@
+import pandas as pd
+import pytest
+import sqlalchemy as sql
+
+import migrate
+from db import add_diary_records_bulk
+from migrate import (
+    NO_TRANSACTION_MARKER,
+    _split_statements,
+    explain_analysis_queries,
+    get_migrations,
+    run_migrations,
+)
+from mock_db import get_random_entry
+
+TEST_USER_ID = "pytest-migrate"
+
+
+def test_split_statements_drops_comments_and_empty_statements():
+    statements = _split_statements(
+        f"{NO_TRANSACTION_MARKER}\n"
+        "-- Comment; with a semicolon\n"
+        "CREATE INDEX CONCURRENTLY a ON t (x);\n"
+        "\n"
+        "CREATE INDEX CONCURRENTLY b\n"
+        "  -- Comment within a statement\n"
+        "  ON t (y);\n"
+        ";\n"
+    )
+
+    assert [" ".join(statement.split()) for statement in statements] == [
+        "CREATE INDEX CONCURRENTLY a ON t (x)",
+        "CREATE INDEX CONCURRENTLY b ON t (y)",
+    ]
+
+
+def test_run_migrations_again_applies_nothing(pg_engine):
+    assert run_migrations(pg_engine) == []
+    with pg_engine.connect() as conn:
+        applied_versions = (
+            conn.execute(sql.text("SELECT version FROM schema_migrations"))
+            .scalars()
+            .all()
+        )
+    assert set(applied_versions) >= {version for version, _, _ in get_migrations()}
+
+
+@pytest.fixture
+def test_migrations_dir(pg_engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(migrate, "MIGRATIONS_DIR", tmp_path)
+    yield tmp_path
+    with pg_engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS pytest_migrate")
+        conn.exec_driver_sql("DELETE FROM schema_migrations WHERE version >= 9000")
+
+
+def test_run_migrations_outside_of_a_transaction(pg_engine, test_migrations_dir):
+    (test_migrations_dir / "9001_create_table.sql").write_text(
+        "CREATE TABLE pytest_migrate (x INTEGER);"
+    )
+    # Fails in a transaction block
+    (test_migrations_dir / "9002_create_index.sql").write_text(
+        f"{NO_TRANSACTION_MARKER}\n"
+        "CREATE INDEX CONCURRENTLY pytest_migrate_x ON pytest_migrate (x);\n"
+        "CREATE INDEX CONCURRENTLY pytest_migrate_x_desc ON pytest_migrate (x DESC);\n"
+    )
+
+    applied_migrations = run_migrations(pg_engine)
+
+    assert applied_migrations == ["9001_create_table", "9002_create_index"]
+    assert run_migrations(pg_engine) == []
+    with pg_engine.connect() as conn:
+        index_names = conn.exec_driver_sql(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'pytest_migrate'"
+        ).scalars()
+        assert sorted(index_names) == ["pytest_migrate_x", "pytest_migrate_x_desc"]
+
+
+def test_failed_migration_is_rolled_back_and_retried(pg_engine, test_migrations_dir):
+    migration_path = test_migrations_dir / "9001_create_table.sql"
+    migration_path.write_text("CREATE TABLE pytest_migrate (x INTEGER); SELECT 1 / 0;")
+
+    with pytest.raises(sql.exc.DataError):
+        run_migrations(pg_engine)
+    with pg_engine.connect() as conn:
+        table_name = conn.exec_driver_sql(
+            "SELECT to_regclass('pytest_migrate')"
+        ).scalar()
+    migration_path.write_text("CREATE TABLE pytest_migrate (x INTEGER);")
+
+    assert table_name is None
+    assert run_migrations(pg_engine) == ["9001_create_table"]
+
+
+@pytest.fixture
+def explain_user(pg_engine):
+    records = [
+        get_random_entry(day.strftime("%Y-%m-%d"))
+        for day in pd.date_range(end=pd.Timestamp.today(), periods=3 * 365)
+    ]
+    add_diary_records_bulk(records, TEST_USER_ID, pg_engine)
+    # Index-only scans need the visibility map, which autovacuum keeps up to date
+    with pg_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM diary")
+    yield TEST_USER_ID
+    with pg_engine.begin() as conn:
+        conn.execute(
+            sql.text("DELETE FROM diary WHERE user_id = :user_id"),
+            {"user_id": TEST_USER_ID},
+        )
+
+
+def test_analysis_queries_use_the_indexes_with_normal_planner_settings(
+    pg_engine, explain_user
+):
+    report = explain_analysis_queries(pg_engine, explain_user)
+
+    assert report["date_range"]["index_scans"] == [
+        "Index Only Scan using diary_date_covering"
+    ]
+    assert all(query_report["uses_index"] for query_report in report.values())
@@ -0,0 +1,74 @@
+import threading
+
+import matplotlib
+import pandas as pd
+import pytest
+
+from db import get_df_with_interval_col
+from mock_db import get_random_entries
+from plots import create_plots, prepare_plot_frames
+
+matplotlib.use("Agg")
+
+
+class CollectingWriter:
+    def __init__(self):
+        self.headings = []
+        self.figures = 0
+
+    def write(self, markdown):
+        self.headings.append(markdown)
+
+    def pyplot(self, figure):
+        self.figures += 1
+
+
+def _get_diary_frame(interval: str, days: int = 30) -> pd.DataFrame:
+    df = pd.DataFrame(get_random_entries(days))
+    df["date"] = pd.to_datetime(df["date"])
+    return get_df_with_interval_col(df, interval=interval)
+
+
+def test_prepare_plot_frames_counts_dizzy_days_per_interval():
+    df = pd.DataFrame(
+        {
+            "date_interval": [1, 0, 0, 1, 1],
+            "dizzy": [True, True, False, True, None],
+            "bodybattery_min": [10, 20, 30, 40, 50],
+            "bodybattery_max": [60, 70, 80, 90, 100],
+        }
+    )
+
+    frames = prepare_plot_frames(df)
+
+    assert frames.intervals == [0, 1]
+    assert frames.records["date_interval"].is_monotonic_increasing
+    assert len(frames.bodybattery_long) == 10
+    dizzy_counts = frames.dizzy_counts.set_index(["date_interval", "dizzy"])["count"]
+    # Dizzy days are negative, intervals without days of a kind have no bar
+    assert dizzy_counts.to_dict() == {(0, True): -1, (1, True): -2, (0, False): 1}
+
+
+@pytest.mark.parametrize("interval", ["1day", "3days", "7days"])
+def test_create_plots_writes_all_charts(interval):
+    writer = CollectingWriter()
+
+    create_plots(_get_diary_frame(interval), interval, out=writer)
+
+    assert writer.figures == len(writer.headings) == (8 if interval == "1day" else 7)
+
+
+def test_create_plots_runs_in_parallel_threads():
+    writers = [CollectingWriter() for _ in range(4)]
+    threads = [
+        threading.Thread(
+            target=create_plots, args=(_get_diary_frame("3days"), "3days", writer)
+        )
+        for writer in writers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [writer.figures for writer in writers] == [7, 7, 7, 7]
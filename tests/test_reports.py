@@ -0,0 +1,167 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import reports
+from db import add_diary_records_bulk
+from mock_db import get_random_entry
+from reports import (
+    _get_section_fingerprints,
+    _get_sections,
+    _replace_file,
+    build_report,
+    get_report,
+)
+
+TEST_USER_ID = "pytest-reports"
+
+
+def test_get_sections_follow_calendar_months_for_days():
+    sections = _get_sections(
+        date(2024, 1, 15), date(2024, 3, 10), "1day", date(2024, 1, 20)
+    )
+
+    assert sections == [
+        (date(2024, 1, 15), date(2024, 1, 31)),
+        (date(2024, 2, 1), date(2024, 2, 29)),
+        (date(2024, 3, 1), date(2024, 3, 10)),
+    ]
+
+
+def test_get_sections_start_with_an_interval():
+    # 7 day intervals start at 2024-01-03, 01-31, 02-07, ..., 02-28, 03-06
+    sections = _get_sections(
+        date(2024, 1, 1), date(2024, 3, 10), "7days", date(2024, 1, 3)
+    )
+
+    assert sections == [
+        (date(2024, 1, 1), date(2024, 2, 6)),
+        (date(2024, 2, 7), date(2024, 3, 5)),
+        (date(2024, 3, 6), date(2024, 3, 10)),
+    ]
+
+
+def test_get_sections_of_one_month():
+    sections = _get_sections(
+        date(2024, 1, 1), date(2024, 1, 20), "3days", date(2024, 1, 2)
+    )
+
+    assert sections == [(date(2024, 1, 1), date(2024, 1, 20))]
+
+
+def test_section_fingerprints_change_with_writes_to_their_section_only():
+    sections = [
+        (date(2024, 1, 1), date(2024, 1, 31)),
+        (date(2024, 2, 1), date(2024, 2, 29)),
+    ]
+    df_modified = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2024-01-05", "2024-02-05"]),
+            "modified_at": pd.to_datetime(
+                ["2024-03-01 10:00", "2024-03-01 10:00"], utc=True
+            ),
+        }
+    )
+    fingerprints = _get_section_fingerprints(sections, df_modified, date(2024, 1, 5))
+
+    df_modified.loc[1, "modified_at"] = pd.Timestamp("2024-03-02 10:00", tz="UTC")
+    modified_fingerprints = _get_section_fingerprints(
+        sections, df_modified, date(2024, 1, 5)
+    )
+    moved_fingerprints = _get_section_fingerprints(
+        sections, df_modified, date(2024, 1, 4)
+    )
+
+    assert modified_fingerprints[0] == fingerprints[0]
+    assert modified_fingerprints[1] != fingerprints[1]
+    assert not set(moved_fingerprints) & set(modified_fingerprints)
+
+
+@pytest.fixture
+def report_user(pg_engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(reports, "REPORTS_DIR", tmp_path)
+    records = [
+        get_random_entry(day.strftime("%Y-%m-%d"))
+        for day in pd.date_range("2024-01-03", "2024-03-10")
+    ]
+    add_diary_records_bulk(records, TEST_USER_ID, pg_engine)
+    yield TEST_USER_ID
+    with pg_engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM diary WHERE user_id = %s", (TEST_USER_ID,))
+
+
+def test_build_report_renders_intervals_of_the_whole_period(
+    pg_engine, report_user, monkeypatch
+):
+    rendered_intervals = []
+
+    def record_intervals(df, interval, out):
+        rendered_intervals.append(sorted(df["date_interval"].unique()))
+
+    monkeypatch.setattr(reports, "create_plots", record_intervals)
+
+    manifest = build_report(
+        date(2024, 1, 1), date(2024, 3, 10), "7days", report_user, pg_engine
+    )
+    rebuilt_sections = build_report(
+        date(2024, 1, 1), date(2024, 3, 10), "7days", report_user, pg_engine
+    )["rebuilt_sections"]
+
+    assert manifest["rebuilt_sections"] == ["2024-01-01", "2024-02-07", "2024-03-06"]
+    # The intervals continue across the sections instead of restarting at 0
+    assert rendered_intervals == [[0, 1, 2, 3, 4], [5, 6, 7, 8], [9]]
+    assert rebuilt_sections == []
+
+
+def test_build_report_of_the_next_day_renders_the_last_section_only(
+    pg_engine, report_user, monkeypatch
+):
+    monkeypatch.setattr(reports, "create_plots", lambda df, interval, out: None)
+
+    build_report(date(2024, 1, 1), date(2024, 3, 9), "7days", report_user, pg_engine)
+    manifest = build_report(
+        date(2024, 1, 1), date(2024, 3, 10), "7days", report_user, pg_engine
+    )
+
+    assert manifest["rebuilt_sections"] == ["2024-03-06"]
+    assert (
+        get_report(date(2024, 1, 1), date(2024, 3, 10), "7days", report_user)[
+            "html_path"
+        ]
+        .read_text()
+        .count("<section>")
+        == 3
+    )
+
+
+def test_build_report_prunes_old_reports_and_their_sections(
+    pg_engine, report_user, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(reports, "create_plots", lambda df, interval, out: None)
+    monkeypatch.setattr(reports, "MAX_REPORTS_PER_USER", 1)
+
+    build_report(date(2024, 1, 1), date(2024, 3, 9), "7days", report_user, pg_engine)
+    build_report(date(2024, 1, 1), date(2024, 3, 10), "7days", report_user, pg_engine)
+
+    assert get_report(date(2024, 1, 1), date(2024, 3, 9), "7days", report_user) is None
+    # The two unchanged sections are still used by the kept report
+    assert len(list(tmp_path.glob("*/sections/7days/*"))) == 3
+    assert not list(tmp_path.glob("**/.*"))
+
+
+def test_replace_file_keeps_the_old_file_if_writing_fails(tmp_path):
+    path = tmp_path / "report.html"
+    path.write_text("old")
+
+    def write_partially(tmp_path):
+        tmp_path.write_text("ne")
+        raise OSError("No space left on device")
+
+    with pytest.raises(OSError):
+        _replace_file(path, write_partially)
+    assert path.read_text() == "old"
+    _replace_file(path, lambda tmp_path: tmp_path.write_text("new"))
+
+    assert path.read_text() == "new"
+    assert [path.name for path in tmp_path.iterdir()] == ["report.html"]
@@ -0,0 +1,50 @@
+import math
+
+import pytest
+import sqlalchemy as sql
+
+from routing import EngineRouter
+
+
+@pytest.fixture
+def router():
+    # The engines only serve as distinct objects, nothing connects
+    primary = sql.create_engine("sqlite://")
+    replicas = [sql.create_engine("sqlite://") for _ in range(3)]
+    return EngineRouter(primary, replicas, max_replica_lag=10.0)
+
+
+def set_replica_lags(router, monkeypatch, lags):
+    replica_lags = dict(zip(router.replicas, lags))
+    monkeypatch.setattr(router, "_get_replica_lag", replica_lags.__getitem__)
+
+
+def test_reader_distributes_reads_over_the_replicas(router, monkeypatch):
+    set_replica_lags(router, monkeypatch, [0.0, 0.0, 0.0])
+
+    readers = [router.reader() for _ in range(4)]
+
+    assert readers == [*router.replicas, router.replicas[0]]
+
+
+def test_reader_skips_lagging_replicas(router, monkeypatch):
+    set_replica_lags(router, monkeypatch, [0.0, 30.0, math.inf])
+
+    assert [router.reader() for _ in range(3)] == [router.replicas[0]] * 3
+
+    set_replica_lags(router, monkeypatch, [30.0, 30.0, math.inf])
+    assert router.reader() is router.primary
+
+
+def test_reader_reads_own_writes_from_the_primary(router, monkeypatch):
+    set_replica_lags(router, monkeypatch, [0.0, 0.0, 0.0])
+
+    assert router.writer() is router.primary
+    assert router.reader() is router.primary
+    assert router.reader(last_write_at=-math.inf) is router.primary
+
+
+def test_unreachable_replica_has_an_infinite_lag(router):
+    # SQLite does not know the lag query of Postgres
+    assert router._get_replica_lag(router.replicas[0]) == math.inf
+    assert router.reader() is router.primary
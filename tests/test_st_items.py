@@ -0,0 +1,84 @@
+from datetime import date
+
+import sqlalchemy as sql
+from streamlit.testing.v1 import AppTest
+
+import st_items
+from db import create_sqlite_comment_search
+
+
+def _show_user_id():
+    import streamlit as st
+
+    from st_items import get_user_id
+
+    st.write(f"user: {get_user_id()}")
+
+
+def test_get_user_id_without_auth_header_is_default_user(monkeypatch):
+    monkeypatch.delenv("AUTH_USER_HEADER", raising=False)
+
+    app = AppTest.from_function(_show_user_id)
+    app.query_params["user"] = "anna"
+    app.run()
+
+    assert [markdown.value for markdown in app.markdown] == ["user: default"]
+
+
+def test_get_user_id_reads_proxy_header(monkeypatch):
+    monkeypatch.setenv("AUTH_USER_HEADER", "X-Forwarded-User")
+    monkeypatch.setattr(
+        st_items, "_get_websocket_headers", lambda: {"X-Forwarded-User": "anna"}
+    )
+
+    app = AppTest.from_function(_show_user_id).run()
+
+    assert [markdown.value for markdown in app.markdown] == ["user: anna"]
+
+
+def test_get_user_id_rejects_sessions_without_header(monkeypatch):
+    monkeypatch.setenv("AUTH_USER_HEADER", "X-Forwarded-User")
+
+    app = AppTest.from_function(_show_user_id)
+    app.query_params["user"] = "anna"
+    app.run()
+
+    assert not app.markdown
+    assert len(app.error) == 1
+
+
+def _show_comment_search():
+    import os
+
+    import sqlalchemy as sql
+    import streamlit as st
+
+    from st_items import show_comment_search
+
+    sql_engine = sql.create_engine(os.environ["TEST_SEARCH_DB_URI"])
+    st.date_input("Datum", key="date")
+    show_comment_search("anna", sql_engine, "date")
+
+
+def test_comment_search_result_jumps_to_its_date(tmp_path, monkeypatch):
+    sql_engine = sql.create_engine(f"sqlite:///{tmp_path / 'diary.sqlite'}")
+    with sql_engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE diary (date DATE, user_id TEXT, comment TEXT)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO diary VALUES ('2024-01-05', 'anna', 'Schwindel am Morgen')"
+        )
+    create_sqlite_comment_search(sql_engine)
+    monkeypatch.setenv("TEST_SEARCH_DB_URI", str(sql_engine.url))
+
+    app = AppTest.from_function(_show_comment_search).run()
+    app.sidebar.text_input[0].input("kopfschmerz").run()
+    no_results = [markdown.value for markdown in app.sidebar.markdown]
+    app.sidebar.text_input[0].input("schwindel").run()
+    app.sidebar.button[0].click().run()
+
+    assert no_results == ["Keine Treffer"]
+    assert app.sidebar.button[0].label == "05.01.2024"
+    assert app.sidebar.markdown[0].value == "**Schwindel** am Morgen"
+    assert app.date_input[0].value == date(2024, 1, 5)
@@ -0,0 +1,157 @@
+import threading
+from datetime import date, timedelta
+
+import matplotlib
+import pandas as pd
+import pytest
+import sqlalchemy as sql
+
+import warmup
+from db import add_diary_records_bulk
+from diary_cache import DiaryCache
+from mock_db import get_random_entry
+from routing import EngineRouter
+from warmup import (
+    DEFAULT_INTERVALS,
+    MAX_TRACKED_VIEWS,
+    RecordingWriter,
+    WarmupScheduler,
+)
+
+matplotlib.use("Agg")
+
+TEST_USER_ID = "pytest-warmup"
+
+
+@pytest.fixture
+def scheduler():
+    # Nothing connects as long as no view is refreshed
+    return WarmupScheduler(
+        EngineRouter(sql.create_engine("sqlite://"), []), DiaryCache()
+    )
+
+
+def test_track_view_drops_the_least_recently_requested(scheduler):
+    for index in range(MAX_TRACKED_VIEWS + 1):
+        scheduler.track_view(f"user-{index}", "3days")
+    scheduler.track_view("user-1", "3days")
+    scheduler.track_view("user-0", "7days")
+
+    assert len(scheduler._views) == MAX_TRACKED_VIEWS
+    assert ("user-0", "3days") not in scheduler._views
+    assert ("user-2", "3days") not in scheduler._views
+    assert {("user-1", "3days"), ("user-0", "7days")} <= scheduler._stale_views
+
+
+def test_invalidation_drops_the_plots_of_the_day(scheduler):
+    scheduler.track_view("anna", "3days")
+    scheduler.track_view("ben", "3days")
+    scheduler._stale_views.clear()
+    scheduler._plots = {
+        ("anna", date(2024, 1, 1), date(2024, 1, 31), "3days"): ["### A"],
+        ("anna", date(2024, 2, 1), date(2024, 2, 29), "3days"): ["### B"],
+        ("ben", date(2024, 1, 1), date(2024, 1, 31), "3days"): ["### C"],
+    }
+
+    scheduler.diary_cache.invalidate("anna", date(2024, 1, 15))
+
+    assert list(scheduler._plots) == [
+        ("anna", date(2024, 2, 1), date(2024, 2, 29), "3days"),
+        ("ben", date(2024, 1, 1), date(2024, 1, 31), "3days"),
+    ]
+    assert scheduler._stale_views == {("anna", "3days")}
+
+
+def test_recording_writer_waits_for_interactive_renders(scheduler):
+    writer = RecordingWriter(before_plot=scheduler._wait_for_interactive_renders)
+    written = threading.Event()
+
+    def write():
+        writer.write("### Schlafzeit")
+        written.set()
+
+    with scheduler.interactive_render():
+        threading.Thread(target=write, daemon=True).start()
+        assert not written.wait(0.2)
+    assert written.wait(5)
+    assert writer.items == ["### Schlafzeit"]
+
+
+@pytest.fixture
+def warmup_user(pg_engine):
+    records = [
+        get_random_entry(day.strftime("%Y-%m-%d"))
+        for day in pd.date_range(date.today() - timedelta(days=20), date.today())
+    ]
+    add_diary_records_bulk(records, TEST_USER_ID, pg_engine)
+    yield TEST_USER_ID
+    with pg_engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM diary WHERE user_id = %s", (TEST_USER_ID,))
+
+
+def test_refresh_views_renders_only_the_requested_intervals(
+    pg_engine, warmup_user, monkeypatch
+):
+    scheduler = WarmupScheduler(EngineRouter(pg_engine, []), DiaryCache())
+    rendered_intervals = []
+
+    def record_interval(df, interval, out):
+        rendered_intervals.append(interval)
+        out.write("### Schlafzeit")
+
+    monkeypatch.setattr(warmup, "create_plots", record_interval)
+
+    scheduler.refresh_views(warmup_user, ["7days"])
+
+    start_date = date.today() - timedelta(days=20)
+    assert rendered_intervals == ["7days"]
+    assert scheduler.get_plots(start_date, date.today(), "7days", warmup_user) == [
+        "### Schlafzeit"
+    ]
+    assert scheduler.get_plots(start_date, date.today(), "3days", warmup_user) is None
+
+
+def test_write_of_another_user_keeps_the_plots(pg_engine, warmup_user, monkeypatch):
+    scheduler = WarmupScheduler(EngineRouter(pg_engine, []), DiaryCache())
+
+    def render_during_write(df, interval, out):
+        scheduler.diary_cache.invalidate("ben", date.today())
+        out.write("### Schlafzeit")
+
+    monkeypatch.setattr(warmup, "create_plots", render_during_write)
+
+    scheduler.refresh_views(warmup_user, ["3days"])
+
+    start_date = date.today() - timedelta(days=20)
+    assert scheduler.get_plots(start_date, date.today(), "3days", warmup_user)
+
+
+def test_write_of_the_user_discards_and_marks_the_view_stale(
+    pg_engine, warmup_user, monkeypatch
+):
+    scheduler = WarmupScheduler(EngineRouter(pg_engine, []), DiaryCache())
+    scheduler.track_view(warmup_user, "3days")
+    scheduler._stale_views.clear()
+
+    def render_during_write(df, interval, out):
+        scheduler.diary_cache.invalidate(warmup_user, date.today())
+        out.write("### Schlafzeit")
+
+    monkeypatch.setattr(warmup, "create_plots", render_during_write)
+
+    scheduler.refresh_views(warmup_user, ["3days"])
+
+    start_date = date.today() - timedelta(days=20)
+    assert scheduler.get_plots(start_date, date.today(), "3days", warmup_user) is None
+    assert scheduler._stale_views == {(warmup_user, "3days")}
+
+
+def test_default_views_of_the_active_users_are_tracked(pg_engine, warmup_user):
+    scheduler = WarmupScheduler(EngineRouter(pg_engine, []), DiaryCache())
+
+    scheduler._track_default_views()
+
+    assert {(warmup_user, interval) for interval in DEFAULT_INTERVALS} <= set(
+        scheduler._views
+    )
+    assert scheduler._stale_views == set(scheduler._views)
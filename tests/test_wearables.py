@@ -0,0 +1,196 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+import sqlalchemy as sql
+
+from db import add_diary_records_bulk, get_diary_record_by_date
+from mock_db import get_random_entry
+from wearables import (
+    add_wearable_samples_bulk,
+    apply_daily_rollups,
+    apply_retention_policy,
+    get_daily_rollups,
+    read_wearable_export,
+)
+
+TEST_USER_ID = "pytest-wearables"
+
+
+def test_read_wearable_export_wide_format(tmp_path):
+    export_path = tmp_path / "export.csv"
+    export_path.write_text(
+        "timestamp,bodybattery,steps\n"
+        "2024-01-10 08:00:10,40,10\n"
+        "2024-01-10 08:00:40,42,15\n"
+        "2024-01-10 08:01:00,45,5\n"
+    )
+
+    df_samples = read_wearable_export(export_path).set_index(["metric", "ts"])
+
+    assert df_samples.loc[("steps", pd.Timestamp("2024-01-10 08:00")), "value"] == 25
+    assert (
+        df_samples.loc[("bodybattery", pd.Timestamp("2024-01-10 08:00")), "value"] == 41
+    )
+    assert len(df_samples) == 4
+
+
+def test_read_wearable_export_long_format(tmp_path):
+    export_path = tmp_path / "export.csv"
+    export_path.write_text(
+        "timestamp,metric,value\n"
+        "2024-01-10T08:00:00,heart_rate,60\n"
+        "2024-01-10T08:00:00,unknown,1\n"
+    )
+
+    df_samples = read_wearable_export(export_path)
+
+    assert df_samples["metric"].tolist() == ["heart_rate"]
+
+
+def test_read_wearable_export_across_dst_change(tmp_path):
+    # Europe/Berlin switches from +01:00 to +02:00 at 2024-03-31 02:00
+    export_path = tmp_path / "export.csv"
+    export_path.write_text(
+        "timestamp,steps\n"
+        "2024-03-30T23:30:00+01:00,100\n"
+        "2024-03-31T01:59:00+01:00,200\n"
+        "2024-03-31T03:00:00+02:00,300\n"
+        "2024-03-31T23:59:00+02:00,400\n"
+        "2024-04-01T00:00:00Z,500\n"
+    )
+
+    df_samples = read_wearable_export(export_path)
+
+    assert df_samples["ts"].dt.tz is None
+    assert df_samples["ts"].tolist() == [
+        pd.Timestamp("2024-03-30 23:30"),
+        pd.Timestamp("2024-03-31 01:59"),
+        pd.Timestamp("2024-03-31 03:00"),
+        pd.Timestamp("2024-03-31 23:59"),
+        pd.Timestamp("2024-04-01 00:00"),
+    ]
+    # Local wall clock time assigns the samples to the days of the diary
+    steps_per_day = df_samples.groupby(df_samples["ts"].dt.date)["value"].sum()
+    assert steps_per_day.tolist() == [100, 900, 500]
+
+
+def test_read_wearable_export_without_timestamp(tmp_path):
+    export_path = tmp_path / "export.csv"
+    export_path.write_text("time,steps\n2024-01-10 08:00,10\n")
+
+    with pytest.raises(ValueError, match="timestamp"):
+        read_wearable_export(export_path)
+
+
+def _get_samples(day: date) -> pd.DataFrame:
+    # Two hours of minute samples, 1 step and a rising body battery per minute
+    timestamps = pd.date_range(
+        pd.Timestamp(day) + pd.Timedelta(hours=8), periods=120, freq="min"
+    )
+    return pd.concat(
+        [
+            pd.DataFrame({"ts": timestamps, "metric": "steps", "value": 1.0}),
+            pd.DataFrame(
+                {"ts": timestamps, "metric": "bodybattery", "value": range(120)}
+            ),
+        ]
+    )
+
+
+@pytest.fixture
+def wearable_user(pg_engine):
+    yield TEST_USER_ID
+    with pg_engine.begin() as conn:
+        for table in ["wearable_samples", "wearable_samples_hourly", "diary"]:
+            conn.execute(
+                sql.text(f"DELETE FROM {table} WHERE user_id = :user_id"),
+                {"user_id": TEST_USER_ID},
+            )
+
+
+def test_bulk_load_skips_imported_samples(pg_engine, wearable_user):
+    day = date.today() - timedelta(days=1)
+
+    first_message = add_wearable_samples_bulk(
+        _get_samples(day), wearable_user, pg_engine
+    )
+    second_message = add_wearable_samples_bulk(
+        _get_samples(day), wearable_user, pg_engine
+    )
+
+    assert first_message == "240 von 240 Messwerten importiert."
+    assert second_message == "0 von 240 Messwerten importiert."
+
+
+def test_daily_rollups_fill_the_empty_diary_fields(pg_engine, wearable_user):
+    day = date.today() - timedelta(days=1)
+    add_wearable_samples_bulk(_get_samples(day), wearable_user, pg_engine)
+    record = get_random_entry(day.strftime("%Y-%m-%d"))
+    record.update(bodybattery_min=5, bodybattery_max=None, steps=None)
+    add_diary_records_bulk([record], wearable_user, pg_engine)
+
+    df_rollups = get_daily_rollups(day, day, wearable_user, pg_engine)
+    message = apply_daily_rollups(day, day, wearable_user, pg_engine)
+
+    assert df_rollups.loc[day].tolist() == [0, 119, 120]
+    assert message == "1 Tagebucheinträge aktualisiert."
+    record = get_diary_record_by_date(day, wearable_user, pg_engine)
+    # Values entered by hand are kept
+    assert (record["bodybattery_min"], record["bodybattery_max"]) == (5, 119)
+    assert record["steps"] == 120
+
+
+def test_retention_downsamples_old_months_without_changing_the_rollups(
+    pg_engine, wearable_user
+):
+    old_day = date.today() - timedelta(days=200)
+    partition_name = f"wearable_samples_y{old_day:%Y}m{old_day:%m}"
+    # Imported as if the retention period had been longer
+    add_wearable_samples_bulk(
+        _get_samples(old_day), wearable_user, pg_engine, raw_retention_days=400
+    )
+    df_raw_rollups = get_daily_rollups(old_day, old_day, wearable_user, pg_engine)
+
+    message = apply_retention_policy(pg_engine)
+    df_hourly_rollups = get_daily_rollups(old_day, old_day, wearable_user, pg_engine)
+    import_message = add_wearable_samples_bulk(
+        _get_samples(old_day), wearable_user, pg_engine
+    )
+
+    assert partition_name in message
+    with pg_engine.connect() as conn:
+        assert (
+            conn.execute(
+                sql.text("SELECT to_regclass(:name)"), {"name": partition_name}
+            ).scalar()
+            is None
+        )
+    assert df_hourly_rollups.equals(df_raw_rollups)
+    # A re-import neither creates the partition again nor doubles the steps
+    assert import_message.startswith("Keine Messwerte ab dem")
+    assert get_daily_rollups(old_day, old_day, wearable_user, pg_engine).equals(
+        df_raw_rollups
+    )
+
+
+def test_retention_finishes_partitions_of_an_interrupted_run(pg_engine, wearable_user):
+    old_day = date.today() - timedelta(days=200)
+    partition_name = f"wearable_samples_y{old_day:%Y}m{old_day:%m}"
+    add_wearable_samples_bulk(
+        _get_samples(old_day), wearable_user, pg_engine, raw_retention_days=400
+    )
+    with pg_engine.begin() as conn:
+        conn.execute(
+            sql.text(f"ALTER TABLE wearable_samples DETACH PARTITION {partition_name}")
+        )
+
+    message = apply_retention_policy(pg_engine)
+
+    assert partition_name in message
+    assert (
+        get_daily_rollups(old_day, old_day, wearable_user, pg_engine).loc[
+            old_day, "steps"
+        ]
+        == 120
+    )
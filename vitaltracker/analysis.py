@@ -1,16 +1,21 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import pandas as pd
 import matplotlib.pyplot as plt
 from plots import create_plots  # type: ignore
 
 import streamlit as st
+import streamlit.components.v1 as components
 from db import (  # type: ignore
     get_postgres_uri,
-    get_sql_engine,
     _get_oldest_diary_record_date,
-    get_diary_records_by_date_range,
     get_df_with_interval_col,
 )
+from anomalies import describe_outlier, describe_shift, find_anomalies  # type: ignore
+from diary_cache import get_diary_cache  # type: ignore
+from reports import get_report, get_report_builder  # type: ignore
+from routing import get_engine_router  # type: ignore
+from st_items import get_user_id  # type: ignore
+from warmup import get_warmup_scheduler, replay_plots  # type: ignore
 from st_pages import add_page_title
 
 add_page_title()
@@ -18,7 +23,10 @@ add_page_title()
 plt.style.use("ggplot")
 
 postgres_uri = get_postgres_uri()
-sql_engine = get_sql_engine(postgres_uri)
+engine_router = get_engine_router(postgres_uri)
+diary_cache = get_diary_cache(engine_router.primary)
+warmup_scheduler = get_warmup_scheduler(engine_router, diary_cache)
+user_id = get_user_id()
 
 col1, col2, col3, col4 = st.columns([1, 1, 2, 1])
 
@@ -58,8 +66,10 @@ def _get_date_timeframe(date_start_default=None) -> tuple[date, date, str] | Non
     return date_start, date_end, str(delta_time)
 
 
-def get_df_diary_records() -> tuple[pd.DataFrame, str]:
-    oldest_diary_record_date = _get_oldest_diary_record_date(sql_engine)
+def get_df_diary_records() -> tuple[pd.DataFrame, date, date, str, bool]:
+    # Analysis reads go to the replicas, unless the diary just changed
+    sql_engine = engine_router.reader(last_write_at=diary_cache.last_changed_at)
+    oldest_diary_record_date = _get_oldest_diary_record_date(user_id, sql_engine)
 
     date_timeframe = _get_date_timeframe(date_start_default=oldest_diary_record_date)
 
@@ -68,21 +78,99 @@ def get_df_diary_records() -> tuple[pd.DataFrame, str]:
 
     date_start, date_end, delta_time = date_timeframe
 
-    df_diary = get_diary_records_by_date_range(
-        start_date=date_start, end_date=date_end, sql_engine=sql_engine
+    df_diary = diary_cache.get_records_by_date_range(
+        start_date=date_start,
+        end_date=date_end,
+        user_id=user_id,
+        sql_engine=sql_engine,
     )
 
     df_diary = get_df_with_interval_col(
         df_diary, interval=delta_time, interval_col_name="date_interval"
     )
-    return df_diary, delta_time
+    is_default_view = (
+        date_start == oldest_diary_record_date and date_end == date.today()
+    )
+    return df_diary, date_start, date_end, delta_time, is_default_view
+
+
+def show_anomalies(df_diary: pd.DataFrame) -> None:
+    df_shifts, df_outliers = find_anomalies(df_diary)
+
+    with st.expander(
+        f"Auffälligkeiten ({len(df_shifts)} Veränderungen, "
+        f"{len(df_outliers)} Ausreißer)"
+    ):
+        st.markdown("#### Veränderungen")
+        if df_shifts.empty:
+            st.write("Keine anhaltenden Veränderungen im Zeitraum.")
+        for shift in df_shifts.to_dict("records"):
+            st.write(describe_shift(shift))
+
+        st.markdown("#### Ausreißer")
+        if df_outliers.empty:
+            st.write("Keine Ausreißer im Zeitraum.")
+        for outlier in df_outliers.to_dict("records"):
+            st.write(describe_outlier(outlier))
+
+
+def show_report(date_start: date, date_end: date, delta_time: str) -> None:
+    report_builder = get_report_builder()
+
+    with st.expander("Bericht"):
+        if st.button("Bericht im Hintergrund erstellen"):
+            report_builder.submit(
+                date_start, date_end, delta_time, user_id, engine_router.reader()
+            )
+
+        if report_builder.is_building(date_start, date_end, delta_time, user_id):
+            st.info("Der Bericht wird erstellt, bitte später neu laden.")
+
+        build_error = report_builder.get_error(
+            date_start, date_end, delta_time, user_id
+        )
+        if build_error is not None:
+            st.error(f"Der Bericht konnte nicht erstellt werden: {build_error}")
+
+        report = get_report(date_start, date_end, delta_time, user_id)
+        if report is None:
+            return
+
+        built_at = datetime.fromisoformat(report["built_at"])
+        st.caption(f"Erstellt am {built_at.strftime('%d.%m.%Y %H:%M')}")
+        st.download_button(
+            "Bericht herunterladen",
+            report["bundle_path"].read_bytes(),
+            file_name=f"bericht_{date_start}_{date_end}_{delta_time}.zip",
+            mime="application/zip",
+        )
+        components.html(report["html_path"].read_text(), height=600, scrolling=True)
 
 
 def run_analysis():
-    df_diary_records, interval_delta_time = get_df_diary_records()
+    (
+        df_diary_records,
+        date_start,
+        date_end,
+        interval_delta_time,
+        is_default_view,
+    ) = get_df_diary_records()
 
     if col4.button("Plot", type="primary", use_container_width=True):
-        create_plots(df_diary_records, interval_delta_time)
+        precomputed_plots = warmup_scheduler.get_plots(
+            date_start, date_end, interval_delta_time, user_id
+        )
+        if precomputed_plots is not None:
+            replay_plots(precomputed_plots)
+        else:
+            with warmup_scheduler.interactive_render():
+                create_plots(df_diary_records, interval_delta_time)
+        # Plots of the default view are precomputed for the next visit
+        if is_default_view:
+            warmup_scheduler.track_view(user_id, interval_delta_time)
+
+    show_anomalies(df_diary_records)
+    show_report(date_start, date_end, interval_delta_time)
 
 
 run_analysis()
@@ -0,0 +1,446 @@
+import threading
+from collections import deque
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import sqlalchemy as sql
+
+import streamlit as st
+
+from db import (  # type: ignore
+    get_diary_modification_state,
+    get_diary_records_by_date_range,
+)
+
+# Metrics checked for regime shifts, with their labels on the analysis page.
+# Dizzy days enter as 0/1, so a shift of their mean is a shift of the frequency.
+SHIFT_METRICS = {
+    "sleep": "Schlafzeit",
+    "bodybattery_min": "Body Battery Min",
+    "bodybattery_max": "Body Battery Max",
+    "steps": "Schritte",
+    "body": "Körpergefühl",
+    "psyche": "Psychegefühl",
+    "dizzy": "Schwindel",
+}
+
+# Metrics checked for single-day outliers. A yes/no answer has no outliers.
+OUTLIER_METRICS = {
+    metric: label for metric, label in SHIFT_METRICS.items() if metric != "dizzy"
+}
+
+# Days before a record, whose median and MAD its z-score is based on
+Z_SCORE_WINDOW = 28
+Z_SCORE_THRESHOLD = 3.5
+
+# Shortest regime which counts as a shift, shorter deviations are outliers
+MIN_SEGMENT_DAYS = 7
+# Penalty per change point in multiples of log(n), higher values find fewer shifts
+PENALTY_FACTOR = 3.0
+# Days of the current regime the online detector keeps
+MAX_SEGMENT_DAYS = 365
+
+
+def _robust_scale(values: np.ndarray) -> float:
+    """Estimates the noise level of a series from the MAD of its differences.
+
+    Differences cancel the level of the regimes, so the estimate is not
+    inflated by the shifts which are to be found.
+    """
+    differences = np.diff(values)
+    mad = np.median(np.abs(differences - np.median(differences)))
+    if mad == 0:
+        mad = np.mean(np.abs(differences - np.median(differences))) / 0.7979
+    return mad / 0.6745 / np.sqrt(2)
+
+
+def detect_change_points(
+    values: np.ndarray,
+    min_size: int = MIN_SEGMENT_DAYS,
+    penalty_factor: float = PENALTY_FACTOR,
+) -> list[int]:
+    """Detects shifts of the mean of a series with binary segmentation.
+
+    Args:
+        values (np.ndarray): The series, without missing values.
+        min_size (int): The shortest segment between two change points.
+        penalty_factor (float): Penalty per change point in multiples of log(n).
+
+    Returns:
+        list[int]: The indices at which a new segment starts, ascending.
+
+    Note:
+        A segment is split where the split reduces the squared error around
+        the segment means the most, as long as the reduction exceeds the
+        penalty. The reduction of every possible split of a segment is
+        computed at once from cumulative sums, so each split costs one
+        vectorized pass over the segment.
+    """
+    n = len(values)
+    if n < 2 * min_size:
+        return []
+
+    scale = _robust_scale(values)
+    if not scale > 0:
+        return []
+
+    normalized = (values - np.median(values)) / scale
+    cumsum = np.concatenate([[0.0], np.cumsum(normalized)])
+    penalty = penalty_factor * np.log(n)
+
+    change_points = []
+    segments = [(0, n)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2 * min_size:
+            continue
+
+        splits = np.arange(start + min_size, end - min_size + 1)
+        left_lengths = splits - start
+        right_lengths = end - splits
+        left_sums = cumsum[splits] - cumsum[start]
+        right_sums = cumsum[end] - cumsum[splits]
+        total_sum = cumsum[end] - cumsum[start]
+        # Reduction of the squared error by splitting, the sums of squares cancel
+        gains = (
+            left_sums**2 / left_lengths
+            + right_sums**2 / right_lengths
+            - total_sum**2 / (end - start)
+        )
+
+        best = np.argmax(gains)
+        if gains[best] > penalty:
+            split = int(splits[best])
+            change_points.append(split)
+            segments.extend([(start, split), (split, end)])
+
+    # A split found within a short segment can fall apart once its neighbours
+    # are known. Drop change points which do not pay off between them.
+    change_points.sort()
+    while change_points:
+        bounds = [0, *change_points, n]
+        gains = []
+        for start, split, end in zip(bounds, bounds[1:], bounds[2:]):
+            left_sum = cumsum[split] - cumsum[start]
+            right_sum = cumsum[end] - cumsum[split]
+            gains.append(
+                left_sum**2 / (split - start)
+                + right_sum**2 / (end - split)
+                - (left_sum + right_sum) ** 2 / (end - start)
+            )
+        weakest = int(np.argmin(gains))
+        if gains[weakest] > penalty:
+            break
+        del change_points[weakest]
+
+    return change_points
+
+
+def _nanmedian_rows(rows: np.ndarray, value_counts: np.ndarray) -> np.ndarray:
+    """Gets the median of each row, ignoring NaN, with one sort of all rows.
+
+    `np.nanmedian` falls back to a Python loop over the rows once there is
+    a NaN, which are common here due to days without a record.
+    """
+    sorted_rows = np.sort(rows, axis=1)
+    lower = np.clip((value_counts - 1) // 2, 0, None)[:, None]
+    upper = np.clip(value_counts // 2, 0, rows.shape[1] - 1)[:, None]
+    medians = (
+        np.take_along_axis(sorted_rows, lower, axis=1)
+        + np.take_along_axis(sorted_rows, upper, axis=1)
+    )[:, 0] / 2
+    medians[value_counts == 0] = np.nan
+    return medians
+
+
+def robust_z_scores(
+    values: np.ndarray, window: int = Z_SCORE_WINDOW
+) -> tuple[np.ndarray, np.ndarray]:
+    """Gets the robust z-score of each value relative to the values before it.
+
+    Args:
+        values (np.ndarray): The series, missing values as NaN.
+        window (int): Number of preceding values the score is based on.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The z-scores, NaN where less than half
+            of the window has values or the window has no spread, and the
+            medians of the windows.
+
+    Note:
+        The score is the distance to the median of the window in units of
+        its median absolute deviation. If more than half of the window has
+        the same value, the mean absolute deviation replaces the MAD.
+    """
+    padded = np.concatenate([np.full(window, np.nan), values[:-1]])
+    windows = sliding_window_view(padded, window)
+    value_counts = np.sum(~np.isnan(windows), axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        medians = _nanmedian_rows(windows, value_counts)
+        deviations = np.abs(windows - medians[:, None])
+        mad = _nanmedian_rows(deviations, value_counts)
+        mean_ad = np.nansum(deviations, axis=1) / value_counts
+
+        z_scores = np.where(
+            mad > 0,
+            0.6745 * (values - medians) / mad,
+            (values - medians) / (1.2533 * mean_ad),
+        )
+    z_scores[(value_counts < window / 2) | ~np.isfinite(z_scores)] = np.nan
+    return z_scores, medians
+
+
+def _get_metric_values(df: pd.DataFrame, metric: str) -> np.ndarray:
+    return pd.to_numeric(df[metric], errors="coerce").to_numpy(dtype=float)
+
+
+def find_anomalies(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Finds regime shifts and single-day outliers in diary records.
+
+    Args:
+        df (pd.DataFrame): Diary records, e.g. from
+            `get_diary_records_by_date_range`, in any order.
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: The shifts with the columns
+            'date', 'metric', 'before' and 'after', i.e. the first day of the
+            new regime and the mean of the metric in the regime before and
+            after it. The outliers with the columns 'date', 'metric', 'value',
+            'median' and 'z_score'.
+    """
+    df = df.sort_values("date")
+    dates = df["date"].to_numpy()
+    shifts = []
+    outliers = []
+
+    for metric, label in SHIFT_METRICS.items():
+        values = _get_metric_values(df, metric)
+        has_value = ~np.isnan(values)
+        metric_dates = dates[has_value]
+        metric_values = values[has_value]
+
+        bounds = [0, *detect_change_points(metric_values), len(metric_values)]
+        for start, change_point, end in zip(bounds, bounds[1:], bounds[2:]):
+            shifts.append(
+                {
+                    "date": metric_dates[change_point],
+                    "metric": label,
+                    "before": metric_values[start:change_point].mean(),
+                    "after": metric_values[change_point:end].mean(),
+                }
+            )
+
+        if metric not in OUTLIER_METRICS:
+            continue
+
+        z_scores, medians = robust_z_scores(values)
+        is_outlier = np.abs(np.nan_to_num(z_scores)) > Z_SCORE_THRESHOLD
+        outliers.append(
+            pd.DataFrame(
+                {
+                    "date": dates[is_outlier],
+                    "metric": label,
+                    "value": values[is_outlier],
+                    "median": medians[is_outlier],
+                    "z_score": z_scores[is_outlier],
+                }
+            )
+        )
+
+    df_shifts = pd.DataFrame(shifts, columns=["date", "metric", "before", "after"])
+    df_outliers = pd.concat(outliers, ignore_index=True)
+    return (
+        df_shifts.sort_values("date", ignore_index=True),
+        df_outliers.sort_values("date", ignore_index=True),
+    )
+
+
+def describe_shift(shift: dict) -> str:
+    """Describes a shift of `find_anomalies` as a sentence for the pages."""
+    if shift["metric"] == SHIFT_METRICS["dizzy"]:
+        change = f"{shift['before']:.0%} → {shift['after']:.0%} der Tage"
+    else:
+        change = f"{shift['before']:.1f} → {shift['after']:.1f}"
+    return (
+        f"{shift['metric']} verändert sich ab "
+        f"{pd.Timestamp(shift['date']).strftime('%d.%m.%Y')}: {change}"
+    )
+
+
+def describe_outlier(outlier: dict) -> str:
+    """Describes an outlier of `find_anomalies` as a sentence for the pages."""
+    return (
+        f"{outlier['metric']} am "
+        f"{pd.Timestamp(outlier['date']).strftime('%d.%m.%Y')} ungewöhnlich: "
+        f"{outlier['value']:g} (Median der Tage davor {outlier['median']:g})"
+    )
+
+
+class OnlineAnomalyDetector:
+    """Checks new diary records of one user as they come in.
+
+    Keeps the last `Z_SCORE_WINDOW` values of each metric for the z-scores
+    and the values of the current regime for the shifts, so that a new
+    record is checked without reading the history again.
+
+    Args:
+        df (pd.DataFrame): The diary records before the first new record.
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        df = df.sort_values("date")
+        self.last_date: date | None = df["date"].iloc[-1].date() if len(df) else None
+        self._windows: dict[str, deque[float]] = {}
+        self._segments: dict[str, tuple[list[date], list[float]]] = {}
+
+        for metric in SHIFT_METRICS:
+            values = _get_metric_values(df, metric)
+            self._windows[metric] = deque(values[-Z_SCORE_WINDOW:], Z_SCORE_WINDOW)
+
+            has_value = ~np.isnan(values)
+            metric_dates = [day.date() for day in df["date"][has_value]]
+            metric_values = values[has_value]
+            change_points = detect_change_points(metric_values)
+            segment_start = max(
+                change_points[-1] if change_points else 0,
+                len(metric_values) - MAX_SEGMENT_DAYS,
+            )
+            self._segments[metric] = (
+                metric_dates[segment_start:],
+                list(metric_values[segment_start:]),
+            )
+
+    def update(self, record: dict) -> tuple[list[dict], list[dict]]:
+        """Checks a new record and adds it to the state.
+
+        Args:
+            record (dict): The diary record, with a date after all records
+                the detector has seen.
+
+        Returns:
+            tuple[list[dict], list[dict]]: The shifts which the record
+                confirms and the outliers of the record, with the keys of the
+                frames returned by `find_anomalies`.
+
+        Raises:
+            ValueError: If the record is not newer than the last one.
+        """
+        record_date = record["date"]
+        if self.last_date is not None and record_date <= self.last_date:
+            raise ValueError(
+                f"Record of {record_date} is not newer than {self.last_date}"
+            )
+        self.last_date = record_date
+
+        shifts = []
+        outliers = []
+        for metric, label in SHIFT_METRICS.items():
+            value = record.get(metric)
+            value = np.nan if value is None else float(value)
+
+            window = self._windows[metric]
+            if metric in OUTLIER_METRICS:
+                z_scores, medians = robust_z_scores(
+                    np.array([*window, value]), Z_SCORE_WINDOW
+                )
+                if abs(np.nan_to_num(z_scores[-1])) > Z_SCORE_THRESHOLD:
+                    outliers.append(
+                        {
+                            "date": record_date,
+                            "metric": label,
+                            "value": value,
+                            "median": medians[-1],
+                            "z_score": z_scores[-1],
+                        }
+                    )
+            window.append(value)
+
+            if np.isnan(value):
+                continue
+            segment_dates, segment_values = self._segments[metric]
+            segment_dates.append(record_date)
+            segment_values.append(value)
+            del segment_dates[:-MAX_SEGMENT_DAYS], segment_values[:-MAX_SEGMENT_DAYS]
+
+            # A new regime is confirmed once it lasted `MIN_SEGMENT_DAYS`
+            change_points = detect_change_points(np.array(segment_values))
+            if not change_points:
+                continue
+            change_point = change_points[-1]
+            shifts.append(
+                {
+                    "date": segment_dates[change_point],
+                    "metric": label,
+                    "before": np.mean(segment_values[:change_point]),
+                    "after": np.mean(segment_values[change_point:]),
+                }
+            )
+            del segment_dates[:change_point], segment_values[:change_point]
+
+        return shifts, outliers
+
+
+class AnomalyTracker:
+    """Keeps an `OnlineAnomalyDetector` per user for the records they add.
+
+    A detector is created from the last `MAX_SEGMENT_DAYS + Z_SCORE_WINDOW`
+    days of the stored diary on the first record of a user, which are all it
+    keeps. Records which change the past instead of adding a new day make the
+    state of the detector invalid, it is created again for the next record.
+    Records of different users are checked concurrently.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._user_locks: dict[str, threading.Lock] = {}
+        self._detectors: dict[str, OnlineAnomalyDetector] = {}
+
+    def update(
+        self, record: dict, user_id: str, sql_engine: sql.Engine
+    ) -> tuple[list[dict], list[dict]]:
+        """Checks a record which was just added to the diary.
+
+        Args:
+            record (dict): The diary record as passed to `add_diary_record`.
+            user_id (str): The user the record belongs to.
+            sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+                for the database, used to create the detector of the user.
+
+        Returns:
+            tuple[list[dict], list[dict]]: The shifts and outliers, see
+                `OnlineAnomalyDetector.update`.
+        """
+        record_date = record["date"]
+        with self._lock:
+            user_lock = self._user_locks.setdefault(user_id, threading.Lock())
+
+        with user_lock:
+            detector = self._detectors.pop(user_id, None)
+            is_newest = True
+            if detector is None or record_date <= detector.last_date:
+                later_records, _ = get_diary_modification_state(
+                    record_date + timedelta(days=1), date.max, user_id, sql_engine
+                )
+                is_newest = later_records == 0
+                df = get_diary_records_by_date_range(
+                    record_date - timedelta(days=MAX_SEGMENT_DAYS + Z_SCORE_WINDOW),
+                    record_date - timedelta(days=1),
+                    user_id,
+                    sql_engine,
+                )
+                detector = OnlineAnomalyDetector(df)
+
+            result = detector.update(record)
+            if is_newest:
+                self._detectors[user_id] = detector
+            return result
+
+
+@st.cache_resource
+def get_anomaly_tracker() -> AnomalyTracker:
+    """Gets the anomaly tracker of the app process."""
+    return AnomalyTracker()
@@ -0,0 +1,280 @@
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+from datetime import date, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import (  # type: ignore
+    get_auth_user_header,
+    get_diary_modification_state,
+    get_diary_records_by_date_range,
+    get_interval_aggregates,
+    get_postgres_uri,
+)
+from routing import EngineRouter, get_engine_router  # type: ignore
+
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", "8502"))
+
+# Length of the returned range if the request has no start date
+DEFAULT_RANGE_DAYS = 30
+
+# Longest interval of the aggregates, about ten years. Longer ones overflow
+# the timedeltas of pandas and cover any diary in one interval anyway.
+MAX_INTERVAL_DAYS = 3660
+INTERVAL_PATTERN = re.compile(r"^([1-9]\d*)days?$")
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Content encodings in order of preference. Parquet is compressed internally
+# with zstd and always sent as is.
+CONTENT_ENCODINGS = ["zstd", "gzip"]
+
+# Responses below this size are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _parse_date(params: dict[str, list[str]], name: str, default: date) -> date:
+    if name not in params:
+        return default
+    try:
+        return date.fromisoformat(params[name][0])
+    except ValueError:
+        raise BadRequest(f"'{name}' must be a date like 2024-01-31") from None
+
+
+def _parse_interval(params: dict[str, list[str]]) -> str:
+    interval = params.get("interval", ["3days"])[0]
+    match = INTERVAL_PATTERN.match(interval)
+    if not match:
+        raise BadRequest("'interval' must be a number of days like '3days'")
+    if int(match.group(1)) > MAX_INTERVAL_DAYS:
+        raise BadRequest(f"'interval' must not be longer than {MAX_INTERVAL_DAYS} days")
+    return interval
+
+
+def _get_format(params: dict[str, list[str]], accept: str) -> str:
+    """Gets the payload format from the 'format' parameter or the Accept header."""
+    if "format" in params:
+        payload_format = params["format"][0]
+        if payload_format not in MEDIA_TYPES:
+            raise BadRequest(f"'format' must be one of {', '.join(MEDIA_TYPES)}")
+        return payload_format
+
+    for payload_format, media_type in MEDIA_TYPES.items():
+        if media_type in accept:
+            return payload_format
+    return "json"
+
+
+def _get_content_encoding(payload_format: str, accept_encoding: str) -> str | None:
+    if payload_format == "parquet":
+        return None
+    accepted = {
+        encoding.split(";")[0].strip() for encoding in accept_encoding.split(",")
+    }
+    return next(
+        (encoding for encoding in CONTENT_ENCODINGS if encoding in accepted), None
+    )
+
+
+def _serialize(df: pd.DataFrame, payload_format: str) -> bytes:
+    """Serializes a DataFrame as JSON records, Arrow IPC stream or Parquet file."""
+    date_columns = [
+        column for column in ("date", "start_date", "end_date") if column in df.columns
+    ]
+
+    if payload_format == "json":
+        df = df.assign(
+            **{column: df[column].dt.strftime("%Y-%m-%d") for column in date_columns}
+        )
+        return df.to_json(orient="records").encode()
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for column in date_columns:
+        table = table.set_column(
+            table.column_names.index(column),
+            column,
+            table[column].cast(pa.date32()),
+        )
+
+    sink = io.BytesIO()
+    if payload_format == "arrow":
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink, compression="zstd")
+    return sink.getvalue()
+
+
+def _compress(payload: bytes, content_encoding: str) -> bytes:
+    if content_encoding == "zstd":
+        return pa.compress(payload, codec="zstd", asbytes=True)
+    return gzip.compress(payload, compresslevel=6)
+
+
+class DiaryRequestHandler(BaseHTTPRequestHandler):
+    """Serves diary ranges and interval aggregates of the authenticated user.
+
+    The user is read from the `auth_user_header` request header, which the
+    authenticating reverse proxy in front of the API sets. Requests without
+    it are rejected with 401.
+
+    Endpoints:
+        GET /diary: The records of a date range.
+        GET /diary/intervals: The records of a date range aggregated per
+            interval, see `get_interval_aggregates`.
+
+    Query parameters:
+        start, end: The date range, defaults to the last `DEFAULT_RANGE_DAYS`
+            days until today.
+        interval: The interval of the aggregates, e.g. '7days'.
+        format: 'json', 'arrow' or 'parquet'. Defaults to the Accept header
+            and to JSON.
+
+    Every response carries an ETag derived from the number and the last
+    modification of the records in the range. If it matches If-None-Match,
+    the response is a 304 without reading the records.
+    """
+
+    server_version = "VitalTrackerAPI/1.0"
+    protocol_version = "HTTP/1.1"
+    engine_router: EngineRouter
+    auth_user_header: str
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path not in ("/diary", "/diary/intervals"):
+            self._send_error(HTTPStatus.NOT_FOUND, f"Unknown path {url.path}")
+            return
+
+        user_id = self.headers.get(self.auth_user_header)
+        if not user_id:
+            self._send_error(HTTPStatus.UNAUTHORIZED, "Not authenticated")
+            return
+
+        params = parse_qs(url.query)
+        try:
+            end_date = _parse_date(params, "end", date.today())
+            start_date = _parse_date(
+                params, "start", end_date - timedelta(days=DEFAULT_RANGE_DAYS)
+            )
+            if start_date > end_date:
+                raise BadRequest("'start' must not be after 'end'")
+
+            interval = None
+            if url.path == "/diary/intervals":
+                interval = _parse_interval(params)
+
+            payload_format = _get_format(params, self.headers.get("Accept", ""))
+        except BadRequest as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        content_encoding = _get_content_encoding(
+            payload_format, self.headers.get("Accept-Encoding", "")
+        )
+
+        # The modification state and the records are read from the same
+        # engine, so that the ETag matches the payload.
+        sql_engine = self.engine_router.reader()
+        try:
+            record_count, last_modified_at = get_diary_modification_state(
+                start_date, end_date, user_id, sql_engine
+            )
+            etag_source = (
+                f"{user_id}|{start_date}|{end_date}|{interval}|{payload_format}|"
+                f"{content_encoding}|{record_count}|{last_modified_at}"
+            )
+            etag = f'"{hashlib.sha1(etag_source.encode()).hexdigest()}"'
+
+            if etag in self.headers.get("If-None-Match", ""):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self._send_cache_headers(etag)
+                self.end_headers()
+                return
+
+            df = get_diary_records_by_date_range(
+                start_date, end_date, user_id, sql_engine
+            )
+        except SQLAlchemyError as e:
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, f"Database error: {e}")
+            return
+
+        if interval is not None:
+            df = get_interval_aggregates(df.sort_values("date"), interval)
+
+        payload = _serialize(df, payload_format)
+        if content_encoding is not None and len(payload) >= MIN_COMPRESS_SIZE:
+            payload = _compress(payload, content_encoding)
+        else:
+            content_encoding = None
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", MEDIA_TYPES[payload_format])
+        self.send_header("Content-Length", str(len(payload)))
+        if content_encoding is not None:
+            self.send_header("Content-Encoding", content_encoding)
+        self._send_cache_headers(etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_cache_headers(self, etag: str) -> None:
+        self.send_header("ETag", etag)
+        # Clients may keep the response, but must revalidate it on every use
+        self.send_header("Cache-Control", "private, no-cache")
+        self.send_header("Vary", f"Accept, Accept-Encoding, {self.auth_user_header}")
+
+    def _send_error(self, status: HTTPStatus, message: str) -> None:
+        body = json.dumps({"error": message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the diary as a read-only API")
+    parser.add_argument(
+        "--host",
+        default=API_HOST,
+        help="Only the authenticating proxy may reach the API, so that it is "
+        "the only one who sets the user header",
+    )
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args()
+
+    auth_user_header = get_auth_user_header()
+    if auth_user_header is None:
+        parser.error("AUTH_USER_HEADER must name the header of the authenticated user")
+
+    DiaryRequestHandler.auth_user_header = auth_user_header
+    DiaryRequestHandler.engine_router = get_engine_router(get_postgres_uri())
+    server = ThreadingHTTPServer((args.host, args.port), DiaryRequestHandler)
+    print(f"Serving the diary API on {args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,19 @@ import streamlit as st
 
 from st_pages import Page, show_pages, add_page_title
 from db import (  # type: ignore
-    get_sql_engine,
+    SAVED_MESSAGE,
     get_postgres_uri,
     add_diary_record,
-    get_diary_record_by_date,
 )
-from st_items import get_items  # type: ignore
+from anomalies import describe_outlier, describe_shift, get_anomaly_tracker  # type: ignore
+from routing import get_engine_router  # type: ignore
+from diary_cache import get_diary_cache  # type: ignore
+from st_items import get_items, get_user_id, show_comment_search  # type: ignore
+from wearables import propose_diary_fields  # type: ignore
+from warmup import get_warmup_scheduler  # type: ignore
+
+# Session state key of the date of the questionnaire
+DATE_KEY = "date_current"
 
 
 def main():
@@ -22,22 +29,32 @@ def main():
     add_page_title()
 
     postgres_uri = get_postgres_uri()
-    sql_engine = get_sql_engine(postgres_uri)
+    engine_router = get_engine_router(postgres_uri)
+    # The questionnaire has to read its own writes, so it stays on the primary
+    sql_engine = engine_router.primary
+    diary_cache = get_diary_cache(sql_engine)
+    # Precomputes the default analysis views from the first page view on
+    get_warmup_scheduler(engine_router, diary_cache)
+    user_id = get_user_id()
+
+    # Default date is "yesterday", the comment search can set another one
+    if DATE_KEY not in st.session_state:
+        st.session_state[DATE_KEY] = date.today() - timedelta(days=1)
 
-    # Default date is "yesterday"
-    date_yesterday = date.today() - timedelta(days=1)
+    show_comment_search(user_id, sql_engine, DATE_KEY)
 
     # Set placeholder for the title
     title = st.empty()
 
     date_current = st.date_input(
         "Datum",
-        date_yesterday,
+        key=DATE_KEY,
         format="DD.MM.YYYY",
     )
 
     if isinstance(date_current, date):
-        records = get_diary_record_by_date(date_current, sql_engine)
+        records = diary_cache.get_record(date_current, user_id, sql_engine)
+        records = propose_diary_fields(records, user_id, sql_engine)
         items = get_items(date_current, records)
         # Update the title with the current date
         title.write(f"## Datum: {date_current.strftime('%d.%m.%Y')}")
@@ -47,9 +64,17 @@ def main():
         items = {}
 
     if st.button("Abschicken", type="primary"):
-        response = add_diary_record(items, sql_engine)
+        response = add_diary_record(items, user_id, engine_router.writer())
+        diary_cache.invalidate(user_id, items["date"])
         st.write(response)
 
+        if response == SAVED_MESSAGE:
+            shifts, outliers = get_anomaly_tracker().update(items, user_id, sql_engine)
+            for outlier in outliers:
+                st.warning(describe_outlier(outlier))
+            for shift in shifts:
+                st.info(describe_shift(shift))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,231 @@
+import json
+import logging
+import select
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Callable
+
+import pandas as pd
+
+import sqlalchemy as sql
+
+import streamlit as st
+
+from db import get_diary_record_by_date, get_diary_records_by_date_range  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Channel on which the `diary_changed` trigger publishes the changed
+# users and dates as JSON, e.g. {"user_id": "default", "date": "2024-01-31"}
+DIARY_CHANNEL = "diary_changed"
+# Payload sent by the trigger if the whole table changed, e.g. on TRUNCATE
+PAYLOAD_ALL = "*"
+
+# Entries kept per kind, the least recently used are dropped first
+MAX_CACHED_RECORDS = 1024
+MAX_CACHED_RANGES = 64
+
+
+class DiaryCache:
+    """Process wide cache of diary reads, invalidated by changed dates.
+
+    Single records are cached per (user, date), date range reads per
+    (user, start, end). Invalidating a date of a user drops its record and
+    every range of the user containing it, so writes only evict the entries
+    they actually affect. At most `MAX_CACHED_RECORDS` records and
+    `MAX_CACHED_RANGES` ranges are kept, the least recently used go first.
+
+    Attributes:
+        last_changed_at (float): `time.monotonic()` of the last invalidation,
+            which can be passed to `EngineRouter.reader` to read the change
+            from the primary until the replicas caught up.
+
+    Note:
+        Every invalidation increments a generation counter. Reads which
+        started before an invalidation are returned but not cached, so a
+        concurrent write can never be masked by an outdated entry.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.last_changed_at = time.monotonic()
+        self._records: OrderedDict[tuple[str, date], dict] = OrderedDict()
+        self._ranges: OrderedDict[tuple[str, date, date], pd.DataFrame] = OrderedDict()
+        self._subscribers: list[Callable[[str | None, date | None], None]] = []
+
+    def subscribe(self, callback: Callable[[str | None, date | None], None]) -> None:
+        """Registers a callback for every invalidation.
+
+        The callback receives the user and the date of an invalidation, or
+        twice None if the whole cache was cleared. It is called from the
+        thread which invalidates, e.g. the change listener, and must not block.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def _notify_subscribers(self, user_id: str | None, day: date | None) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(user_id, day)
+
+    def get_record(self, day: date, user_id: str, sql_engine: sql.Engine) -> dict:
+        """Gets the diary record of a date, see `get_diary_record_by_date`.
+
+        Returns:
+            dict: A copy of the cached record, which may be modified freely.
+        """
+        with self._lock:
+            record = self._records.get((user_id, day))
+            if record is not None:
+                self._records.move_to_end((user_id, day))
+            generation = self._generation
+
+        if record is None:
+            record = get_diary_record_by_date(day, user_id, sql_engine)
+            with self._lock:
+                if generation == self._generation:
+                    self._records[(user_id, day)] = record
+                    if len(self._records) > MAX_CACHED_RECORDS:
+                        self._records.popitem(last=False)
+
+        return dict(record)
+
+    def get_records_by_date_range(
+        self, start_date: date, end_date: date, user_id: str, sql_engine: sql.Engine
+    ) -> pd.DataFrame:
+        """Gets the diary records of a date range, see `get_diary_records_by_date_range`.
+
+        Returns:
+            pd.DataFrame: A copy of the cached records, which may be modified freely.
+        """
+        with self._lock:
+            df_diary = self._ranges.get((user_id, start_date, end_date))
+            if df_diary is not None:
+                self._ranges.move_to_end((user_id, start_date, end_date))
+            generation = self._generation
+
+        if df_diary is None:
+            df_diary = get_diary_records_by_date_range(
+                start_date=start_date,
+                end_date=end_date,
+                user_id=user_id,
+                sql_engine=sql_engine,
+            )
+            with self._lock:
+                if generation == self._generation:
+                    self._ranges[(user_id, start_date, end_date)] = df_diary
+                    if len(self._ranges) > MAX_CACHED_RANGES:
+                        self._ranges.popitem(last=False)
+
+        return df_diary.copy()
+
+    def invalidate(self, user_id: str, day: date) -> None:
+        """Drops all cache entries of the user which contain the given date."""
+        with self._lock:
+            self._generation += 1
+            self.last_changed_at = time.monotonic()
+            self._records.pop((user_id, day), None)
+            for range_user_id, start_date, end_date in list(self._ranges):
+                if range_user_id == user_id and start_date <= day <= end_date:
+                    del self._ranges[(range_user_id, start_date, end_date)]
+        self._notify_subscribers(user_id, day)
+
+    def clear(self) -> None:
+        """Drops all cache entries."""
+        with self._lock:
+            self._generation += 1
+            self.last_changed_at = time.monotonic()
+            self._records.clear()
+            self._ranges.clear()
+        self._notify_subscribers(None, None)
+
+    def handle_notification(self, payload: str) -> None:
+        """Invalidates the cache for a payload sent on the `diary_changed` channel."""
+        if payload == PAYLOAD_ALL:
+            self.clear()
+        else:
+            change = json.loads(payload)
+            self.invalidate(change["user_id"], date.fromisoformat(change["date"]))
+
+
+def listen_for_diary_changes(
+    sql_engine: sql.Engine,
+    cache: DiaryCache,
+    stop_event: threading.Event,
+    poll_timeout: float = 5.0,
+    reconnect_delay: float = 5.0,
+) -> None:
+    """Invalidates the cache on every change notification of the diary table.
+
+    Blocks until `stop_event` is set and is meant to run in its own thread.
+
+    Args:
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+        cache (DiaryCache): The cache to invalidate.
+        stop_event (threading.Event): Event which stops the listener.
+        poll_timeout (float): Seconds to wait for notifications before
+            checking `stop_event` again.
+        reconnect_delay (float): Seconds to wait before reconnecting after
+            the connection was lost.
+
+    Note:
+        The listener uses a dedicated connection, detached from the pool.
+        Notifications sent while it was disconnected are lost, therefore the
+        whole cache is cleared whenever the connection is (re-)established.
+    """
+    while not stop_event.is_set():
+        try:
+            pool_conn = sql_engine.raw_connection()
+            dbapi_conn = pool_conn.driver_connection
+            assert dbapi_conn is not None
+            pool_conn.detach()
+            dbapi_conn.autocommit = True
+            dbapi_conn.cursor().execute(f"LISTEN {DIARY_CHANNEL}")
+            cache.clear()
+
+            try:
+                while not stop_event.is_set():
+                    readable, _, _ = select.select([dbapi_conn], [], [], poll_timeout)
+                    if not readable:
+                        continue
+                    dbapi_conn.poll()
+                    while dbapi_conn.notifies:
+                        notification = dbapi_conn.notifies.pop(0)
+                        cache.handle_notification(notification.payload)
+            finally:
+                dbapi_conn.close()
+
+        except Exception:
+            logger.exception("Diary change listener lost its connection.")
+            cache.clear()
+            stop_event.wait(reconnect_delay)
+
+
+@st.cache_resource
+def get_diary_cache(_sql_engine: sql.Engine) -> DiaryCache:
+    """Gets the diary cache of the app process.
+
+    The cache is created once per process together with a daemon thread,
+    which keeps it consistent with writes of all other app replicas.
+
+    Args:
+        _sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database, used by the change listener.
+
+    Returns:
+        DiaryCache: The process wide diary cache.
+    """
+    cache = DiaryCache()
+    listener = threading.Thread(
+        target=listen_for_diary_changes,
+        args=(_sql_engine, cache, threading.Event()),
+        name="diary-change-listener",
+        daemon=True,
+    )
+    listener.start()
+    return cache
@@ -0,0 +1,547 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import numpy as np
+import pandas as pd
+
+import sqlalchemy as sql
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import WebSocketClientConnection, websocket_connect
+
+from db import _read_sql_as_df, add_diary_records_bulk, get_sql_engine  # type: ignore
+from migrate import run_migrations  # type: ignore
+from mock_db import get_random_entries  # type: ignore
+
+APP_DIR = Path(__file__).parent
+
+# Every simulated session works on the diary of its own synthetic user
+LOADTEST_USER_PREFIX = "loadtest-"
+
+# Header of the authenticated user, which the sessions send instead of a proxy
+LOADTEST_AUTH_HEADER = "X-Loadtest-User"
+
+# Hosts of databases the load test may write to without --allow-remote-db
+LOCAL_DB_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+# Application name of the connections of the app server, to tell them apart
+SERVER_APPLICATION_NAME = "vitaltracker-loadtest"
+
+# Page names as sent by the browser, the questionnaire is the main page
+FORM_PAGE = ""
+ANALYSIS_PAGE = "Analyse"
+
+STEPS = ["load_form", "change_date", "submit", "load_analysis", "change_range", "plot"]
+
+
+def is_local_database(db_uri: str) -> bool:
+    """Checks whether a database URI points to this machine, via TCP or a socket."""
+    url = sql.make_url(db_uri)
+    if url.host is not None:
+        return url.host in LOCAL_DB_HOSTS
+    socket_host = url.query.get("host")
+    if isinstance(socket_host, tuple):
+        socket_host = socket_host[0]
+    return socket_host is None or socket_host.startswith("/")
+
+
+def seed_loadtest_users(sessions: int, days: int, sql_engine: sql.Engine) -> None:
+    """Replaces the diaries of the load test users with random records.
+
+    Args:
+        sessions (int): Number of simulated sessions, one user each.
+        days (int): Number of past days to create records for.
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+    """
+    with sql_engine.begin() as conn:
+        conn.execute(
+            sql.text("DELETE FROM diary WHERE user_id LIKE :prefix"),
+            {"prefix": f"{LOADTEST_USER_PREFIX}%"},
+        )
+    for session_id in range(sessions):
+        add_diary_records_bulk(
+            get_random_entries(days),
+            f"{LOADTEST_USER_PREFIX}{session_id}",
+            sql_engine,
+        )
+
+
+def start_app_server(db_uri: str, port: int, timeout: float) -> subprocess.Popen:
+    """Starts the app with `streamlit run`, as the container does.
+
+    Args:
+        db_uri (str): URI of the database the app uses.
+        port (int): Port of the app server.
+        timeout (float): Seconds to wait until the server is healthy.
+
+    Returns:
+        subprocess.Popen: The running server process.
+    """
+    url = sql.make_url(db_uri).update_query_dict(
+        {"application_name": SERVER_APPLICATION_NAME}
+    )
+    env = {
+        **os.environ,
+        "PG_URI": url.render_as_string(hide_password=False),
+        "AUTH_USER_HEADER": LOADTEST_AUTH_HEADER,
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "streamlit",
+            "run",
+            str(APP_DIR / "app.py"),
+            "--server.headless=true",
+            f"--server.port={port}",
+            "--server.address=127.0.0.1",
+        ],
+        cwd=APP_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The app server exited with {server.returncode}.")
+        try:
+            with urllib.request.urlopen(
+                f"http://127.0.0.1:{port}/_stcore/health", timeout=1
+            ):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"The app server was not healthy after {timeout} s.")
+
+
+class BrowserSession:
+    """Drives the pages like a browser tab, over the websocket of the app server.
+
+    The session keeps the widgets of the current page and sends their values
+    with every rerun, as the frontend of Streamlit does.
+
+    Args:
+        port (int): Port of the app server.
+        user_id (str): The user, sent in the header of the authenticating proxy.
+        timeout (float): Seconds after which a single rerun fails.
+    """
+
+    def __init__(self, port: int, user_id: str, timeout: float) -> None:
+        self.port = port
+        self.user_id = user_id
+        self.timeout = timeout
+
+        self._connection: WebSocketClientConnection | None = None
+        self._page_name = FORM_PAGE
+        # Widgets of the current page by label, and the values set so far
+        self._widgets: dict[str, Any] = {}
+        self._widget_states: dict[str, WidgetState] = {}
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+
+    async def open_page(self, page_name: str) -> bool:
+        """Opens a page, see `_rerun`."""
+        if self._connection is None:
+            request = HTTPRequest(
+                f"ws://127.0.0.1:{self.port}/_stcore/stream",
+                headers={LOADTEST_AUTH_HEADER: self.user_id},
+            )
+            self._connection = await websocket_connect(request)
+        self._page_name = page_name
+        self._widgets.clear()
+        self._widget_states.clear()
+        return await self._rerun()
+
+    async def change(self, values: dict[str, date | str]) -> bool:
+        """Sets date inputs and select sliders by their labels, see `_rerun`."""
+        for label, value in values.items():
+            widget = self._widgets[label]
+            widget_state = WidgetState(id=widget.id)
+            if isinstance(value, date):
+                widget_state.string_array_value.data[:] = [value.strftime("%Y/%m/%d")]
+            else:
+                widget_state.double_array_value.data[:] = [
+                    list(widget.options).index(value)
+                ]
+            self._widget_states[widget.id] = widget_state
+        return await self._rerun()
+
+    async def click(self, label: str) -> bool:
+        """Clicks a button by its label, see `_rerun`."""
+        trigger = WidgetState(id=self._widgets[label].id, trigger_value=True)
+        return await self._rerun(trigger)
+
+    async def _rerun(self, trigger: WidgetState | None = None) -> bool:
+        """Reruns the current page and waits until its script finished.
+
+        Returns:
+            bool: Whether the script finished without showing an exception.
+
+        Raises:
+            ConnectionError: If the server closed the connection.
+            TimeoutError: If the script did not finish within the timeout.
+        """
+        assert self._connection is not None
+        back_msg = BackMsg()
+        back_msg.rerun_script.page_name = self._page_name
+        back_msg.rerun_script.widget_states.widgets.extend(
+            [*self._widget_states.values(), *([trigger] if trigger else [])]
+        )
+        await self._connection.write_message(back_msg.SerializeToString(), binary=True)
+        return await asyncio.wait_for(self._read_script_run(), self.timeout)
+
+    async def _read_script_run(self) -> bool:
+        assert self._connection is not None
+        succeeded = True
+        while True:
+            payload = await self._connection.read_message()
+            if payload is None:
+                raise ConnectionError("The app server closed the connection.")
+            forward_msg = ForwardMsg()
+            forward_msg.ParseFromString(payload)
+            msg_type = forward_msg.WhichOneof("type")
+
+            if msg_type == "page_not_found":
+                succeeded = False
+            elif msg_type == "delta" and forward_msg.delta.HasField("new_element"):
+                element = forward_msg.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type is None:
+                    continue
+                if element_type == "exception":
+                    succeeded = False
+                widget = getattr(element, element_type)
+                if getattr(widget, "id", ""):
+                    self._widgets[widget.label] = widget
+            elif msg_type == "script_finished":
+                return succeeded and (
+                    forward_msg.script_finished
+                    == ForwardMsg.ScriptFinishedStatus.FINISHED_SUCCESSFULLY
+                )
+
+
+async def run_session(
+    port: int,
+    session_id: int,
+    iterations: int,
+    plot_days: int,
+    timeout: float,
+    timings: dict[str, list[float]],
+    errors: dict[str, int],
+) -> None:
+    """Simulates one user working through the questionnaire and the analysis.
+
+    Each iteration opens a new browser tab. A failed step leaves the page in
+    an unknown state, so the rest of the iteration is skipped.
+
+    Args:
+        port (int): Port of the app server.
+        session_id (int): Number of the session, selects its user.
+        iterations (int): How often the session repeats all steps.
+        plot_days (int): Length of the plotted period in days.
+        timeout (float): Seconds after which a single step fails.
+        timings (dict[str, list[float]]): Durations per step, appended to.
+        errors (dict[str, int]): Number of failed steps per step, counted up.
+    """
+    user_id = f"{LOADTEST_USER_PREFIX}{session_id}"
+    date_today = date.today()
+
+    for _ in range(iterations):
+        session = BrowserSession(port, user_id, timeout)
+        form_date = date_today - timedelta(days=random.randint(1, 30))
+        analysis_range: dict[str, date | str] = {
+            "Datum Start": date_today - timedelta(days=plot_days),
+            "Zeitspanne / Intervall": random.choice(["1day", "3days", "7days"]),
+        }
+        steps: list[tuple[str, Callable[[], Awaitable[bool]]]] = [
+            ("load_form", lambda: session.open_page(FORM_PAGE)),
+            ("change_date", lambda: session.change({"Datum": form_date})),
+            ("submit", lambda: session.click("Abschicken")),
+            ("load_analysis", lambda: session.open_page(ANALYSIS_PAGE)),
+            ("change_range", lambda: session.change(analysis_range)),
+            ("plot", lambda: session.click("Plot")),
+        ]
+
+        try:
+            for step, run_step in steps:
+                start = time.perf_counter()
+                try:
+                    succeeded = await run_step()
+                except (KeyError, OSError, TimeoutError):
+                    succeeded = False
+                timings[step].append(time.perf_counter() - start)
+                if not succeeded:
+                    errors[step] += 1
+                    break
+        finally:
+            session.close()
+
+
+def _read_rss_mb(pid: int) -> float:
+    """Reads the resident set size of a process from /proc."""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _monitor_server(
+    pid: int,
+    sql_engine: sql.Engine,
+    stop_event: threading.Event,
+    samples: dict[str, list[float]],
+    interval: float = 0.2,
+) -> None:
+    """Samples the RSS and the open database connections of the app server."""
+    count_stmt = sql.text(
+        """
+        SELECT count(*) FROM pg_stat_activity
+        WHERE datname = current_database() AND application_name = :name
+        """
+    )
+    with sql_engine.connect() as conn:
+        while not stop_event.is_set():
+            samples["rss_mb"].append(_read_rss_mb(pid))
+            samples["db_connections"].append(
+                conn.execute(count_stmt, {"name": SERVER_APPLICATION_NAME}).scalar_one()
+            )
+            conn.commit()
+            stop_event.wait(interval)
+
+
+async def _run_sessions(
+    port: int,
+    sessions: int,
+    iterations: int,
+    plot_days: int,
+    timeout: float,
+    timings: dict[str, list[float]],
+    errors: dict[str, int],
+) -> None:
+    await asyncio.gather(
+        *[
+            run_session(
+                port, session_id, iterations, plot_days, timeout, timings, errors
+            )
+            for session_id in range(sessions)
+        ]
+    )
+
+
+def run_loadtest(
+    sessions: int,
+    iterations: int,
+    plot_days: int,
+    timeout: float,
+    port: int,
+    db_uri: str,
+    sql_engine: sql.Engine,
+) -> dict:
+    """Runs concurrent simulated sessions against one app server.
+
+    Args:
+        sessions (int): Number of concurrent sessions.
+        iterations (int): How often each session repeats all steps.
+        plot_days (int): Length of the plotted period in days.
+        timeout (float): Seconds after which a single step fails.
+        port (int): Port of the app server started for the test.
+        db_uri (str): URI of the database the app server uses.
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database, used to sample the connections of the server.
+
+    Returns:
+        dict: Latency percentiles and error count per step, throughput, and
+            the database connections and the RSS of the app server.
+
+    Note:
+        The server is started fresh, so the first sessions include its cold
+        start. All sessions share its caches, pools and background threads,
+        like the sessions of one container.
+    """
+    timings: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    samples: dict[str, list[float]] = defaultdict(list)
+
+    server = start_app_server(db_uri, port, timeout)
+    try:
+        idle_rss_mb = _read_rss_mb(server.pid)
+        stop_event = threading.Event()
+        monitor = threading.Thread(
+            target=_monitor_server,
+            args=(server.pid, sql_engine, stop_event, samples),
+            daemon=True,
+        )
+        monitor.start()
+
+        started_at = time.perf_counter()
+        asyncio.run(
+            _run_sessions(
+                port, sessions, iterations, plot_days, timeout, timings, errors
+            )
+        )
+        duration = time.perf_counter() - started_at
+
+        stop_event.set()
+        monitor.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    steps = {}
+    for step in STEPS:
+        step_ms = np.array(timings[step] or [np.nan]) * 1000
+        steps[step] = {
+            "count": len(timings[step]),
+            "errors": errors[step],
+            "p50_ms": round(float(np.percentile(step_ms, 50)), 1),
+            "p95_ms": round(float(np.percentile(step_ms, 95)), 1),
+            "p99_ms": round(float(np.percentile(step_ms, 99)), 1),
+        }
+
+    return {
+        "sessions": sessions,
+        "duration_s": round(duration, 2),
+        "steps": steps,
+        "throughput_steps_per_s": round(sum(map(len, timings.values())) / duration, 2),
+        "db_connections_peak": int(max(samples["db_connections"], default=0)),
+        "db_connections_mean": round(
+            float(np.mean(samples["db_connections"] or [0])), 1
+        ),
+        "idle_rss_mb": round(idle_rss_mb, 1),
+        "peak_rss_mb": round(max(samples["rss_mb"], default=idle_rss_mb), 1),
+    }
+
+
+def benchmark_frame_reads(sql_engine: sql.Engine, repeat: int = 3) -> dict:
+    """Times reading the diaries of all load test users into one DataFrame.
+
+    Compares the Arrow read path of the app with `pd.read_sql_query`.
+
+    Returns:
+        dict: The number of rows and the best duration per read path.
+    """
+    query = sql.text("SELECT * FROM diary WHERE user_id LIKE :prefix")
+    params = {"prefix": f"{LOADTEST_USER_PREFIX}%"}
+    read_paths = {
+        "arrow": lambda: _read_sql_as_df(query, params, sql_engine),
+        "read_sql_query": lambda: pd.read_sql_query(query, sql_engine, params=params),
+    }
+
+    report = {}
+    for name, read in read_paths.items():
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = len(read())
+            durations.append(time.perf_counter() - start)
+        report[name] = {"rows": rows, "best_ms": round(min(durations) * 1000, 1)}
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['sessions']} Sitzungen, {report['duration_s']} s, "
+        f"{report['throughput_steps_per_s']} Schritte/s"
+    )
+    print(f"{'Schritt':<15}{'Anzahl':>8}{'Fehler':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for step, stats in report["steps"].items():
+        print(
+            f"{step:<15}{stats['count']:>8}{stats['errors']:>8}"
+            f"{stats['p50_ms']:>8.0f}ms{stats['p95_ms']:>8.0f}ms{stats['p99_ms']:>8.0f}ms"
+        )
+    print(
+        f"DB Verbindungen des Servers: max {report['db_connections_peak']}, "
+        f"Mittel {report['db_connections_mean']}"
+    )
+    print(
+        f"RSS des Servers: {report['idle_rss_mb']} MB im Leerlauf, "
+        f"max {report['peak_rss_mb']} MB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load test both pages with concurrent simulated sessions. "
+        "Run it against a throwaway database only, it writes to the diary."
+    )
+    parser.add_argument(
+        "--db-uri",
+        required=True,
+        help="URI of a local throwaway database, e.g. postgresql://postgres:pw@"
+        "localhost:5433/moodfit_loadtest",
+    )
+    parser.add_argument(
+        "--allow-remote-db",
+        action="store_true",
+        help="Allow a database on another host, which must be a throwaway one",
+    )
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--plot-days", type=int, default=30)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--port", type=int, default=8599, help="Port of the app server to start"
+    )
+    parser.add_argument(
+        "--seed-days",
+        type=int,
+        default=0,
+        help="Replace the diaries of the load test users with random records",
+    )
+    parser.add_argument(
+        "--read-benchmark",
+        action="store_true",
+        help="Only time reading the diaries of the load test users",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    if not (args.allow_remote_db or is_local_database(args.db_uri)):
+        parser.error("--db-uri is not a local database, see --allow-remote-db")
+    sql_engine = get_sql_engine({"uri": args.db_uri})
+    run_migrations(sql_engine)
+    if args.seed_days:
+        seed_loadtest_users(args.sessions, args.seed_days, sql_engine)
+
+    if args.read_benchmark:
+        print(json.dumps(benchmark_frame_reads(sql_engine), indent=2))
+        return
+
+    report = run_loadtest(
+        args.sessions,
+        args.iterations,
+        args.plot_days,
+        args.timeout,
+        args.port,
+        args.db_uri,
+        sql_engine,
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
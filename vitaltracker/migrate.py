@@ -0,0 +1,243 @@
+import argparse
+import json
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+import sqlalchemy as sql
+
+from db import DEFAULT_USER_ID, DIARY_ANALYSIS_COLUMNS, get_postgres_uri, get_sql_engine  # type: ignore
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+# Key of the advisory lock which serializes concurrently starting app replicas
+MIGRATION_LOCK_ID = 7_146_893
+
+# First line of migrations which must run outside of a transaction,
+# e.g. `CREATE INDEX CONCURRENTLY`. Their statements are split on ";"
+# and therefore must not contain function bodies.
+NO_TRANSACTION_MARKER = "-- migrate:no-transaction"
+
+# Analysis queries and the indexes each of them is expected to use
+ANALYSIS_QUERIES = {
+    "date_range": (
+        f"""
+        SELECT {", ".join(DIARY_ANALYSIS_COLUMNS)}
+        FROM diary
+        WHERE user_id = :user_id AND date BETWEEN :start_date AND :end_date
+        ORDER BY date DESC
+        """,
+        {"diary_pkey", "diary_date_covering", "diary_date_brin"},
+    ),
+    "oldest_date": (
+        "SELECT date FROM diary WHERE user_id = :user_id ORDER BY date ASC LIMIT 1",
+        {"diary_pkey", "diary_date_covering"},
+    ),
+    "dizzy_days": (
+        """
+        SELECT date FROM diary
+        WHERE dizzy AND user_id = :user_id AND date BETWEEN :start_date AND :end_date
+        """,
+        {"diary_dizzy_date"},
+    ),
+}
+
+
+def get_migrations() -> list[tuple[int, str, str]]:
+    """Gets all migrations, ordered by version.
+
+    Returns:
+        list[tuple[int, str, str]]: Version, name and SQL of each migration,
+            read from the files `<version>_<name>.sql` in `MIGRATIONS_DIR`.
+    """
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        version, name = path.stem.split("_", 1)
+        migrations.append((int(version), name, path.read_text()))
+    return migrations
+
+
+def _split_statements(migration_sql: str) -> list[str]:
+    # Comments go first, they may contain a ";" themselves
+    lines = [
+        line for line in migration_sql.splitlines() if not line.strip().startswith("--")
+    ]
+    return [statement for statement in "\n".join(lines).split(";") if statement.strip()]
+
+
+def run_migrations(sql_engine: sql.Engine) -> list[str]:
+    """Applies all pending migrations to the database.
+
+    Args:
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+
+    Returns:
+        list[str]: The names of the applied migrations.
+
+    Raises:
+        SQLAlchemyError: If a migration fails. Migrations which run in a
+            transaction are rolled back completely and retried on the next run.
+
+    Note:
+        Applied versions are recorded in the `schema_migrations` table. An
+        advisory lock ensures that only one process migrates at a time, so
+        all app replicas can run the migrations on startup.
+    """
+    applied_migrations = []
+
+    with sql_engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as lock_conn:
+        lock_conn.execute(
+            sql.text(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+                """
+            )
+        )
+        lock_conn.execute(
+            sql.text("SELECT pg_advisory_lock(:lock_id)"),
+            {"lock_id": MIGRATION_LOCK_ID},
+        )
+        try:
+            applied_versions = set(
+                lock_conn.execute(sql.text("SELECT version FROM schema_migrations"))
+                .scalars()
+                .all()
+            )
+            record_stmt = sql.text(
+                "INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"
+            )
+
+            for version, name, migration_sql in get_migrations():
+                if version in applied_versions:
+                    continue
+
+                if migration_sql.startswith(NO_TRANSACTION_MARKER):
+                    for statement in _split_statements(migration_sql):
+                        lock_conn.exec_driver_sql(statement)
+                    lock_conn.execute(record_stmt, {"version": version, "name": name})
+                else:
+                    with sql_engine.begin() as conn:
+                        conn.exec_driver_sql(migration_sql)
+                        conn.execute(record_stmt, {"version": version, "name": name})
+
+                applied_migrations.append(f"{version:04d}_{name}")
+
+        finally:
+            lock_conn.execute(
+                sql.text("SELECT pg_advisory_unlock(:lock_id)"),
+                {"lock_id": MIGRATION_LOCK_ID},
+            )
+
+    return applied_migrations
+
+
+def _get_plan_index_scans(plan: dict) -> set[tuple[str, str]]:
+    index_scans = (
+        {(plan["Node Type"], plan["Index Name"])} if "Index Name" in plan else set()
+    )
+    for subplan in plan.get("Plans", []):
+        index_scans |= _get_plan_index_scans(subplan)
+    return index_scans
+
+
+def explain_analysis_queries(
+    sql_engine: sql.Engine, user_id: str = DEFAULT_USER_ID
+) -> dict[str, dict]:
+    """Runs `EXPLAIN ANALYZE` for the analysis queries and checks their index usage.
+
+    Args:
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+        user_id (str): The user whose diary is queried. Defaults to the
+            default user.
+
+    Returns:
+        dict[str, dict]: For each query of `ANALYSIS_QUERIES` the index scans
+            as '<node type> using <index>', the execution time in ms and
+            whether an expected index was used.
+
+    Note:
+        The diary is analyzed first and the planner runs with its normal
+        settings, so the plans are those of the app. On a small history the
+        planner rightly prefers sequential scans, the check is meaningful on
+        a realistic amount of data only. Index-only scans also need an up to
+        date visibility map, i.e. a vacuumed table. Indexes of partitions are
+        reported by the name of their partitioned parent index.
+    """
+    params = {
+        "user_id": user_id,
+        "start_date": date.today() - timedelta(days=365),
+        "end_date": date.today(),
+    }
+    report = {}
+
+    with sql_engine.begin() as conn:
+        conn.execute(sql.text("ANALYZE diary"))
+        partition_index_rows = conn.execute(
+            sql.text(
+                """
+                SELECT relname, pg_partition_root(oid)::regclass::text
+                FROM pg_class
+                WHERE relkind = 'i' AND relispartition
+                """
+            )
+        ).all()
+        root_index_names: dict[str, str] = {
+            index_name: root_index_name
+            for index_name, root_index_name in partition_index_rows
+        }
+        for query_name, (query, expected_indexes) in ANALYSIS_QUERIES.items():
+            explain_stmt = sql.text(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+            explain_result = conn.execute(explain_stmt, params).scalar_one()
+            plan = explain_result[0]
+            index_scans = {
+                (node_type, root_index_names.get(index_name, index_name))
+                for node_type, index_name in _get_plan_index_scans(plan["Plan"])
+            }
+            report[query_name] = {
+                "index_scans": sorted(
+                    f"{node_type} using {index_name}"
+                    for node_type, index_name in index_scans
+                ),
+                "execution_time_ms": plan["Execution Time"],
+                "uses_index": any(
+                    index_name in expected_indexes for _, index_name in index_scans
+                ),
+            }
+
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Check that the analysis queries use the indexes",
+    )
+    parser.add_argument(
+        "--user", default=DEFAULT_USER_ID, help="User of the checked queries"
+    )
+    args = parser.parse_args()
+
+    sql_engine = get_sql_engine(get_postgres_uri())
+
+    for migration in run_migrations(sql_engine):
+        print(f"Applied {migration}")
+
+    if args.explain:
+        report = explain_analysis_queries(sql_engine, args.user)
+        print(json.dumps(report, indent=2))
+        if not all(query_report["uses_index"] for query_report in report.values()):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS diary (
+  date DATE PRIMARY KEY,
+  tasks INTEGER[],
+  sleep FLOAT,
+  bodybattery_min INTEGER,
+  bodybattery_max INTEGER,
+  steps INTEGER,
+  body INTEGER,
+  psyche INTEGER,
+  dizzy BOOLEAN,
+  comment TEXT
+);
@@ -0,0 +1,18 @@
+-- Intraday samples of wearables, partitioned by month
+CREATE TABLE IF NOT EXISTS wearable_samples (
+  ts TIMESTAMP NOT NULL,
+  metric TEXT NOT NULL,
+  value REAL NOT NULL,
+  PRIMARY KEY (metric, ts)
+) PARTITION BY RANGE (ts);
+
+-- Hourly aggregates of downsampled wearable samples
+CREATE TABLE IF NOT EXISTS wearable_samples_hourly (
+  ts TIMESTAMP NOT NULL,
+  metric TEXT NOT NULL,
+  min_value REAL,
+  max_value REAL,
+  sum_value REAL,
+  sample_count INTEGER,
+  PRIMARY KEY (metric, ts)
+);
@@ -0,0 +1,27 @@
+-- Publish the changed dates of the diary, so that app replicas can
+-- invalidate their caches
+CREATE OR REPLACE FUNCTION notify_diary_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    PERFORM pg_notify('diary_changed', '*');
+    RETURN NULL;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM pg_notify('diary_changed', OLD.date::text);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.date IS DISTINCT FROM OLD.date THEN
+    PERFORM pg_notify('diary_changed', NEW.date::text);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS diary_changed ON diary;
+CREATE TRIGGER diary_changed
+AFTER INSERT OR UPDATE OR DELETE ON diary
+FOR EACH ROW EXECUTE FUNCTION notify_diary_change();
+
+DROP TRIGGER IF EXISTS diary_truncated ON diary;
+CREATE TRIGGER diary_truncated
+AFTER TRUNCATE ON diary
+FOR EACH STATEMENT EXECUTE FUNCTION notify_diary_change();
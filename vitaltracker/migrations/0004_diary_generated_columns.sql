@@ -0,0 +1,11 @@
+-- Sum of the task levels of a day, e.g. {1,3} -> 4
+CREATE OR REPLACE FUNCTION diary_task_load(tasks INTEGER[]) RETURNS INTEGER
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT COALESCE(SUM(task), 0)::INTEGER FROM unnest(tasks) AS task
+$$;
+
+ALTER TABLE diary
+  ADD COLUMN IF NOT EXISTS bodybattery_range INTEGER
+    GENERATED ALWAYS AS (bodybattery_max - bodybattery_min) STORED,
+  ADD COLUMN IF NOT EXISTS task_load INTEGER
+    GENERATED ALWAYS AS (diary_task_load(tasks)) STORED;
@@ -0,0 +1,16 @@
+-- migrate:no-transaction
+-- Indexes are built concurrently, so that the app keeps writing meanwhile.
+
+-- Compact index for range scans over long histories
+CREATE INDEX CONCURRENTLY IF NOT EXISTS diary_date_brin
+  ON diary USING brin (date);
+
+-- Covers all columns of the analysis range reads for index-only scans
+CREATE INDEX CONCURRENTLY IF NOT EXISTS diary_date_covering
+  ON diary (date)
+  INCLUDE (tasks, sleep, bodybattery_min, bodybattery_max, steps, body, psyche, dizzy, bodybattery_range, task_load);
+
+-- Dizzy days are the minority, a partial index keeps their lookup small
+CREATE INDEX CONCURRENTLY IF NOT EXISTS diary_dizzy_date
+  ON diary (date)
+  WHERE dizzy;
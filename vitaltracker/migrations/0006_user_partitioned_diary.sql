@@ -0,0 +1,102 @@
+-- Adds the user dimension to the diary and wearable samples. The diary is
+-- hash partitioned by user, so that the range reads of one user only touch
+-- a single partition. Existing records are assigned to the user 'default'.
+
+CREATE TABLE diary_partitioned (
+  user_id TEXT NOT NULL,
+  date DATE NOT NULL,
+  tasks INTEGER[],
+  sleep FLOAT,
+  bodybattery_min INTEGER,
+  bodybattery_max INTEGER,
+  steps INTEGER,
+  body INTEGER,
+  psyche INTEGER,
+  dizzy BOOLEAN,
+  comment TEXT,
+  bodybattery_range INTEGER
+    GENERATED ALWAYS AS (bodybattery_max - bodybattery_min) STORED,
+  task_load INTEGER
+    GENERATED ALWAYS AS (diary_task_load(tasks)) STORED,
+  PRIMARY KEY (user_id, date)
+) PARTITION BY HASH (user_id);
+
+CREATE TABLE diary_p00 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 0);
+CREATE TABLE diary_p01 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 1);
+CREATE TABLE diary_p02 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 2);
+CREATE TABLE diary_p03 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 3);
+CREATE TABLE diary_p04 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 4);
+CREATE TABLE diary_p05 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 5);
+CREATE TABLE diary_p06 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 6);
+CREATE TABLE diary_p07 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 7);
+CREATE TABLE diary_p08 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 8);
+CREATE TABLE diary_p09 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 9);
+CREATE TABLE diary_p10 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 10);
+CREATE TABLE diary_p11 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 11);
+CREATE TABLE diary_p12 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 12);
+CREATE TABLE diary_p13 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 13);
+CREATE TABLE diary_p14 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 14);
+CREATE TABLE diary_p15 PARTITION OF diary_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER 15);
+
+INSERT INTO diary_partitioned
+  (user_id, date, tasks, sleep, bodybattery_min, bodybattery_max, steps, body, psyche, dizzy, comment)
+SELECT 'default', date, tasks, sleep, bodybattery_min, bodybattery_max, steps, body, psyche, dizzy, comment
+FROM diary;
+
+-- Drops the old indexes and triggers together with the table
+DROP TABLE diary;
+ALTER TABLE diary_partitioned RENAME TO diary;
+ALTER TABLE diary RENAME CONSTRAINT diary_partitioned_pkey TO diary_pkey;
+
+-- Indexes on partitioned tables cannot be built concurrently. They are
+-- created here, while the table is still new and locked by the migration.
+CREATE INDEX diary_date_brin ON diary USING brin (date);
+CREATE INDEX diary_date_covering
+  ON diary (user_id, date)
+  INCLUDE (tasks, sleep, bodybattery_min, bodybattery_max, steps, body, psyche, dizzy, bodybattery_range, task_load);
+CREATE INDEX diary_dizzy_date ON diary (user_id, date) WHERE dizzy;
+
+-- Notifications carry the user, so that caches invalidate per user and date
+CREATE OR REPLACE FUNCTION notify_diary_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    PERFORM pg_notify('diary_changed', '*');
+    RETURN NULL;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM pg_notify(
+      'diary_changed',
+      json_build_object('user_id', OLD.user_id, 'date', OLD.date)::text
+    );
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE')
+    AND (NEW.user_id, NEW.date) IS DISTINCT FROM (OLD.user_id, OLD.date) THEN
+    PERFORM pg_notify(
+      'diary_changed',
+      json_build_object('user_id', NEW.user_id, 'date', NEW.date)::text
+    );
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER diary_changed
+AFTER INSERT OR UPDATE OR DELETE ON diary
+FOR EACH ROW EXECUTE FUNCTION notify_diary_change();
+
+CREATE TRIGGER diary_truncated
+AFTER TRUNCATE ON diary
+FOR EACH STATEMENT EXECUTE FUNCTION notify_diary_change();
+
+-- Wearable samples keep their monthly partitions and gain the user as key
+ALTER TABLE wearable_samples ADD COLUMN user_id TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE wearable_samples ALTER COLUMN user_id DROP DEFAULT;
+ALTER TABLE wearable_samples
+  DROP CONSTRAINT wearable_samples_pkey,
+  ADD PRIMARY KEY (user_id, metric, ts);
+
+ALTER TABLE wearable_samples_hourly ADD COLUMN user_id TEXT NOT NULL DEFAULT 'default';
+ALTER TABLE wearable_samples_hourly ALTER COLUMN user_id DROP DEFAULT;
+ALTER TABLE wearable_samples_hourly
+  DROP CONSTRAINT wearable_samples_hourly_pkey,
+  ADD PRIMARY KEY (user_id, metric, ts);
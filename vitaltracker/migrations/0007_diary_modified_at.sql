@@ -0,0 +1,14 @@
+-- Last modification of each record, e.g. to rebuild only the outdated
+-- sections of reports. Existing records get the time of the migration.
+ALTER TABLE diary ADD COLUMN modified_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION touch_diary_modified_at() RETURNS trigger AS $$
+BEGIN
+  NEW.modified_at := now();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER diary_modified_at
+BEFORE UPDATE ON diary
+FOR EACH ROW EXECUTE FUNCTION touch_diary_modified_at();
@@ -0,0 +1,9 @@
+-- Full-text search over the comments. The search vector is stored, so that
+-- a search reads the GIN index of the user's partition instead of parsing
+-- every comment of the history.
+ALTER TABLE diary
+  ADD COLUMN comment_tsv TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('german', COALESCE(comment, ''))) STORED;
+
+-- Indexes on partitioned tables cannot be built concurrently, see 0006
+CREATE INDEX diary_comment_tsv ON diary USING gin (comment_tsv);
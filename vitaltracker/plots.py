@@ -1,7 +1,11 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import seaborn as sns
-import matplotlib.pyplot as plt
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+
+from typing import Any, NamedTuple
 
 X_LABEL = "Zeitintervall"
 Y_LABELS = {
@@ -14,121 +18,190 @@ Y_LABELS = {
 }
 
 
-def _concat_columns(df: pd.DataFrame, cols: list[str], new_col_name: str) -> pd.Series:
-    bodybattery = pd.concat(
-        [
-            df[cols[0]],
-            df[cols[1]],
-        ]
+class PlotFrames(NamedTuple):
+    """The data of all plots, prepared in one pass by `prepare_plot_frames`."""
+
+    # Diary records sorted by 'date_interval'
+    records: pd.DataFrame
+    # Sorted intervals, i.e. the categories of the x-axis of all plots
+    intervals: list[int]
+    # Body battery min and max in one column 'bodybattery', with 'date_interval'
+    bodybattery_long: pd.DataFrame
+    # Number of days with and without dizziness per interval, dizzy days negative
+    dizzy_counts: pd.DataFrame
+
+
+def prepare_plot_frames(df: pd.DataFrame) -> PlotFrames:
+    """Prepares the groupings and reshapes of all plots in one vectorized pass.
+
+    Args:
+        df (pd.DataFrame): Diary records with a 'date_interval' column.
+
+    Returns:
+        PlotFrames: The frames the plot functions draw from.
+    """
+    records = df.sort_values("date_interval", kind="stable")
+    dizzy = records["dizzy"]
+
+    interval_stats = (
+        records.assign(dizzy_yes=dizzy.eq(True), dizzy_no=dizzy.eq(False))
+        .groupby("date_interval", sort=True)
+        .agg(dizzy_yes=("dizzy_yes", "sum"), dizzy_no=("dizzy_no", "sum"))
     )
-    bodybattery.name = new_col_name
-    return bodybattery
+    intervals = interval_stats.index.tolist()
 
+    bodybattery_long = records.melt(
+        id_vars="date_interval",
+        value_vars=["bodybattery_min", "bodybattery_max"],
+        value_name="bodybattery",
+    )
 
-def _merge_pd_series(col1: pd.Series, col2: pd.Series) -> pd.DataFrame:
-    return pd.DataFrame({f"{col1.name}": col1, f"{col2.name}": col2})
+    # Intervals without days of one kind get no bar instead of an empty one
+    dizzy_counts = pd.DataFrame(
+        {
+            "date_interval": np.tile(intervals, 2),
+            "dizzy": np.repeat([True, False], len(intervals)),
+            "count": np.concatenate(
+                [-interval_stats["dizzy_yes"], interval_stats["dizzy_no"]]
+            ),
+        }
+    )
+    dizzy_counts = dizzy_counts[dizzy_counts["count"] != 0]
+
+    return PlotFrames(records, intervals, bodybattery_long, dizzy_counts)
+
+
+def _new_axes() -> Axes:
+    """Creates the axes of a plot in a figure of its own.
 
+    Unlike the global figure of pyplot, such a figure belongs to the thread
+    which draws it, so sessions and the warmup can plot at the same time.
+    """
+    return Figure().subplots()
+
+
+def run_interval_plots(frames: PlotFrames, interval: str, out: Any = st) -> None:
+    df = frames.records
 
-def run_interval_plots(df: pd.DataFrame, interval: str) -> None:
     # Sleep
-    st.write("### Schlafzeit")
-    plot_sleep = sns.boxplot(y=df["sleep"], x=df["date_interval"])
+    out.write("### Schlafzeit")
+    plot_sleep = sns.boxplot(
+        x="date_interval",
+        y="sleep",
+        data=df,
+        order=frames.intervals,
+        ax=_new_axes(),
+    )
     plot_sleep.set_xlabel(X_LABEL + f" [{interval}]")
     plot_sleep.set_ylabel(Y_LABELS["sleep"])
-    st.pyplot(plot_sleep.get_figure())
-    plt.clf()
+    out.pyplot(plot_sleep.get_figure())
 
     # Body Battery
-    st.write("### Body Battery Min / Max")
+    out.write("### Body Battery Min / Max")
     plot_bodybattery = sns.stripplot(
-        x=df["date_interval"], y="bodybattery_min", data=df, jitter=True
+        x="date_interval",
+        y="bodybattery_min",
+        data=df,
+        order=frames.intervals,
+        jitter=True,
+        ax=_new_axes(),
     )
     plot_bodybattery = sns.pointplot(
-        x=df["date_interval"],
+        x="date_interval",
         y="bodybattery_min",
         data=df,
+        order=frames.intervals,
         linestyle="none",
         capsize=0.2,
         color="black",
+        ax=plot_bodybattery,
     )
     plot_bodybattery = sns.stripplot(
-        x=df["date_interval"], y="bodybattery_max", data=df, jitter=True
+        x="date_interval",
+        y="bodybattery_max",
+        data=df,
+        order=frames.intervals,
+        jitter=True,
+        ax=plot_bodybattery,
     )
     plot_bodybattery = sns.pointplot(
-        x=df["date_interval"],
+        x="date_interval",
         y="bodybattery_max",
         data=df,
+        order=frames.intervals,
         linestyle="none",
         capsize=0.2,
         color="black",
+        ax=plot_bodybattery,
     )
     plot_bodybattery.set_xlabel(X_LABEL + f" [{interval}]")
     plot_bodybattery.set_ylabel(Y_LABELS["bodybattery"])
-    st.pyplot(plot_bodybattery.get_figure())
-    plt.clf()
+    out.pyplot(plot_bodybattery.get_figure())
 
     # Body Battery (violin)
-    st.write("### Body Battery Min/Max (Violin)")
-    series_bodybattery = _concat_columns(
-        df, ["bodybattery_min", "bodybattery_max"], "bodybattery"
-    )
-
-    series_date_interval = _concat_columns(
-        df, ["date_interval", "date_interval"], "date_interval"
-    )
-
-    df_bodybattery_min_max_merged = _merge_pd_series(
-        series_bodybattery, series_date_interval
-    )
-
+    out.write("### Body Battery Min/Max (Violin)")
     plot_bodybattery_violin = sns.violinplot(
-        x="date_interval", y="bodybattery", data=df_bodybattery_min_max_merged
+        x="date_interval",
+        y="bodybattery",
+        data=frames.bodybattery_long,
+        order=frames.intervals,
+        ax=_new_axes(),
     )
     plot_bodybattery_violin.set_xlabel(X_LABEL + f" [{interval}]")
     plot_bodybattery_violin.set_ylabel(Y_LABELS["bodybattery"])
-    st.pyplot(plot_bodybattery_violin.get_figure())
-    plt.clf()
+    out.pyplot(plot_bodybattery_violin.get_figure())
 
     # Steps
-    st.write("### Schritte")
-    plot_steps = sns.boxplot(y=df["steps"], x=df["date_interval"])
+    out.write("### Schritte")
+    plot_steps = sns.boxplot(
+        x="date_interval",
+        y="steps",
+        data=df,
+        order=frames.intervals,
+        ax=_new_axes(),
+    )
     plot_steps.set_xlabel(X_LABEL + f" [{interval}]")
     plot_steps.set_ylabel(Y_LABELS["steps"])
-    st.pyplot(plot_steps.get_figure())
-    plt.clf()
+    out.pyplot(plot_steps.get_figure())
 
     # Body
-    st.write("### Körpergefühl")
-    plot_body = sns.boxplot(y=df["body"], x=df["date_interval"])
+    out.write("### Körpergefühl")
+    plot_body = sns.boxplot(
+        x="date_interval",
+        y="body",
+        data=df,
+        order=frames.intervals,
+        ax=_new_axes(),
+    )
     plot_body.set_xlabel(X_LABEL + f" [{interval}]")
     plot_body.set_ylabel(Y_LABELS["body"])
-    st.pyplot(plot_body.get_figure())
-    plt.clf()
+    out.pyplot(plot_body.get_figure())
 
     # Psyche
-    st.write("### Psychegefühl")
-    plot_psyche = sns.boxplot(y=df["psyche"], x=df["date_interval"])
+    out.write("### Psychegefühl")
+    plot_psyche = sns.boxplot(
+        x="date_interval",
+        y="psyche",
+        data=df,
+        order=frames.intervals,
+        ax=_new_axes(),
+    )
     plot_psyche.set_xlabel(X_LABEL + f" [{interval}]")
     plot_psyche.set_ylabel(Y_LABELS["psyche"])
-    st.pyplot(plot_psyche.get_figure())
-    plt.clf()
+    out.pyplot(plot_psyche.get_figure())
 
     # Dizzy: Plus / Minus Balkendiagramm
-    # Prepare data
-    df_dizzy = df.groupby("date_interval")["dizzy"].value_counts().reset_index()
-
-    df_dizzy["count"] = df_dizzy.apply(
-        lambda x: -x["count"] if x["dizzy"] is True else x["count"], axis=1
-    )
-
-    st.write("### Schwindel")
+    out.write("### Schwindel")
     plot_dizzy = sns.barplot(
         x="date_interval",
         y="count",
         hue="dizzy",
-        data=df_dizzy,
+        data=frames.dizzy_counts,
+        order=frames.intervals,
         dodge=False,
         hue_order=[True, False],
+        errorbar=None,
+        ax=_new_axes(),
     )
     plot_dizzy.set_label("Schwindel")
 
@@ -140,84 +213,91 @@ def run_interval_plots(df: pd.DataFrame, interval: str) -> None:
     plot_dizzy.set_xlabel(X_LABEL + f" [{interval}]")
     plot_dizzy.set_ylabel(Y_LABELS["dizzy"])
     # Adjusting the plot to make it more readable
-    plt.axhline(0, color="black", linewidth=0.8)
+    plot_dizzy.axhline(0, color="black", linewidth=0.8)
+
+    out.pyplot(plot_dizzy.get_figure())
 
-    st.pyplot(plot_dizzy.get_figure())
-    plt.clf()
 
+def run_daily_plots(frames: PlotFrames, out: Any = st) -> None:
+    df = frames.records
 
-def run_daily_plots(df: pd.DataFrame) -> None:
     # Sleep
-    st.write("### Schlafzeit")
-    plot_sleep = sns.lineplot(y="sleep", x="date_interval", data=df)
+    out.write("### Schlafzeit")
+    plot_sleep = sns.lineplot(y="sleep", x="date_interval", data=df, ax=_new_axes())
     plot_sleep.set_ylabel(Y_LABELS["sleep"])
-    st.pyplot(plot_sleep.get_figure())
-    plt.clf()
+    out.pyplot(plot_sleep.get_figure())
 
-    st.write("### Schlafzeit | Regression")
-    plot_sleep_reg = sns.regplot(x="date_interval", y="sleep", order=3, data=df)
+    out.write("### Schlafzeit | Regression")
+    plot_sleep_reg = sns.regplot(
+        x="date_interval", y="sleep", order=3, data=df, ax=_new_axes()
+    )
     plot_sleep_reg.set_ylabel(Y_LABELS["sleep"])
-    st.pyplot(plot_sleep_reg.get_figure())
-    plt.clf()
+    out.pyplot(plot_sleep_reg.get_figure())
 
-    st.write("### Schlafzeit | Barplot")
-    plot_sleep_bar = sns.barplot(x="date_interval", y="sleep", data=df)
-    plot_sleep_bar.set_xticks(range(0, len(df["date_interval"]), 20))
+    out.write("### Schlafzeit | Barplot")
+    plot_sleep_bar = sns.barplot(
+        x="date_interval",
+        y="sleep",
+        data=df,
+        order=frames.intervals,
+        errorbar=None,
+        ax=_new_axes(),
+    )
+    plot_sleep_bar.set_xticks(range(0, len(frames.intervals), 20))
     plot_sleep_bar.set_ylabel(Y_LABELS["sleep"])
-    st.pyplot(plot_sleep_bar.get_figure())
-    plt.clf()
+    out.pyplot(plot_sleep_bar.get_figure())
 
     # Body Battery
-    st.write("### Body Battery Min / Max")
+    out.write("### Body Battery Min / Max")
 
     plot_bodybattery = sns.regplot(
-        x="date_interval", y="bodybattery_min", order=3, data=df
+        x="date_interval",
+        y="bodybattery_min",
+        order=3,
+        data=df,
+        ax=_new_axes(),
     )
     plot_bodybattery = sns.regplot(
-        x="date_interval", y="bodybattery_max", order=3, data=df
+        x="date_interval",
+        y="bodybattery_max",
+        order=3,
+        data=df,
+        ax=plot_bodybattery,
     )
 
     plot_bodybattery.set_ylabel(Y_LABELS["bodybattery"])
-    st.pyplot(plot_bodybattery.get_figure())
-    plt.clf()
+    out.pyplot(plot_bodybattery.get_figure())
 
     # Steps
-    st.write("### Schritte")
-    plot_steps = sns.regplot(y="steps", x="date_interval", data=df)
+    out.write("### Schritte")
+    plot_steps = sns.regplot(y="steps", x="date_interval", data=df, ax=_new_axes())
     plot_steps.set_ylabel(Y_LABELS["steps"])
-    st.pyplot(plot_steps.get_figure())
-    plt.clf()
+    out.pyplot(plot_steps.get_figure())
 
     # Body
-    st.write("### Körpergefühl")
-    plot_body = sns.regplot(y="body", x="date_interval", data=df)
+    out.write("### Körpergefühl")
+    plot_body = sns.regplot(y="body", x="date_interval", data=df, ax=_new_axes())
     plot_body.set_ylabel(Y_LABELS["body"])
-    st.pyplot(plot_body.get_figure())
-    plt.clf()
+    out.pyplot(plot_body.get_figure())
 
     # Psyche
-    st.write("### Psychegefühl")
-    plot_psyche = sns.regplot(y="psyche", x="date_interval", data=df)
+    out.write("### Psychegefühl")
+    plot_psyche = sns.regplot(y="psyche", x="date_interval", data=df, ax=_new_axes())
     plot_psyche.set_ylabel(Y_LABELS["psyche"])
-    st.pyplot(plot_psyche.get_figure())
-    plt.clf()
+    out.pyplot(plot_psyche.get_figure())
 
     # Dizzy: Plus / Minus Balkendiagramm
-    # Prepare data
-    df_dizzy = df.groupby("date_interval")["dizzy"].value_counts().reset_index()
-
-    df_dizzy["count"] = df_dizzy.apply(
-        lambda x: -x["count"] if x["dizzy"] is True else x["count"], axis=1
-    )
-
-    st.write("### Schwindel")
+    out.write("### Schwindel")
     plot_dizzy = sns.barplot(
         x="date_interval",
         y="count",
         hue="dizzy",
-        data=df_dizzy,
+        data=frames.dizzy_counts,
+        order=frames.intervals,
         dodge=False,
         hue_order=[True, False],
+        errorbar=None,
+        ax=_new_axes(),
     )
     # Set the labels of the legend
     new_labels = ["Ja", "Nein"]
@@ -225,16 +305,25 @@ def run_daily_plots(df: pd.DataFrame) -> None:
         t.set_text(label)
 
     plot_dizzy.set_ylabel(Y_LABELS["dizzy"])
-    plot_dizzy.set_xticks(range(0, len(df_dizzy["date_interval"]), 20))
+    plot_dizzy.set_xticks(range(0, len(frames.intervals), 20))
     # Adjusting the plot to make it more readable
-    plt.axhline(0, color="black", linewidth=0.8)
+    plot_dizzy.axhline(0, color="black", linewidth=0.8)
+
+    out.pyplot(plot_dizzy.get_figure())
 
-    st.pyplot(plot_dizzy.get_figure())
-    plt.clf()
 
+def create_plots(df: pd.DataFrame, interval: str, out: Any = st) -> None:
+    """Creates all plots of the analysis for the given interval.
 
-def create_plots(df: pd.DataFrame, interval: str) -> None:
+    Args:
+        df (pd.DataFrame): Diary records with a 'date_interval' column.
+        interval (str): The interval of the 'date_interval' column, e.g. '3days'.
+        out (Any): Target of the headings and figures. Anything with the
+            methods `write(markdown)` and `pyplot(figure)`, defaults to the
+            Streamlit page.
+    """
+    frames = prepare_plot_frames(df)
     if interval == "1day":
-        run_daily_plots(df)
+        run_daily_plots(frames, out)
     else:
-        run_interval_plots(df, interval)
+        run_interval_plots(frames, interval, out)
@@ -0,0 +1,434 @@
+import base64
+import hashlib
+import html
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+import sqlalchemy as sql
+
+import streamlit as st
+
+from db import (  # type: ignore
+    get_df_with_interval_col,
+    get_diary_modification_dates,
+    get_diary_records_by_date_range,
+)
+from plots import create_plots  # type: ignore
+
+# Reports are a cache, they are kept outside of the source tree
+REPORTS_DIR = Path(
+    os.environ.get(
+        "REPORTS_DIR",
+        Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+        / "vitaltracker"
+        / "reports",
+    )
+)
+
+# Reports kept per user, the sections of older ones are deleted unless shared
+MAX_REPORTS_PER_USER = 8
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html lang="de">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; max-width: 960px; margin: auto; }}
+img {{ max-width: 100%; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p>Erstellt am {built_at}</p>
+{sections}
+</body>
+</html>
+"""
+
+
+class _SectionWriter:
+    """Collects the headings and figures of `create_plots` as HTML and PDF."""
+
+    def __init__(self, pdf_path: Path) -> None:
+        self.html_parts: list[str] = []
+        self._pdf = PdfPages(pdf_path)
+
+    def write(self, markdown: str) -> None:
+        level = len(markdown) - len(markdown.lstrip("#"))
+        heading = html.escape(markdown.lstrip("# "))
+        self.html_parts.append(f"<h{level}>{heading}</h{level}>")
+
+    def pyplot(self, figure: Figure) -> None:
+        png_buffer = io.BytesIO()
+        figure.savefig(png_buffer, format="png", bbox_inches="tight")
+        png_base64 = base64.b64encode(png_buffer.getvalue()).decode()
+        self.html_parts.append(f'<img src="data:image/png;base64,{png_base64}">')
+        self._pdf.savefig(figure, bbox_inches="tight")
+
+    def close(self) -> None:
+        self._pdf.close()
+
+
+def _get_user_dir(user_id: str) -> Path:
+    user_hash = hashlib.sha1(user_id.encode()).hexdigest()[:8]
+    user_name = re.sub(r"[^\w-]", "_", user_id)
+    return REPORTS_DIR / f"{user_name}-{user_hash}"
+
+
+def get_report_dir(
+    start_date: date, end_date: date, interval: str, user_id: str
+) -> Path:
+    """Gets the directory of the report for a period, interval and user."""
+    return _get_user_dir(user_id) / "reports" / f"{start_date}_{end_date}_{interval}"
+
+
+def get_section_dir(
+    section_start: date,
+    section_end: date,
+    interval: str,
+    fingerprint: str,
+    user_id: str,
+) -> Path:
+    """Gets the directory of a rendered section, shared by all reports containing it.
+
+    The directory changes with the fingerprint of the section, so a section
+    in it is never outdated.
+    """
+    fingerprint_hash = hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+    return (
+        _get_user_dir(user_id)
+        / "sections"
+        / interval
+        / f"{section_start}_{section_end}_{fingerprint_hash}"
+    )
+
+
+def _replace_file(path: Path, write_file: Callable[[Path], object]) -> None:
+    """Writes a file under a temporary name and renames it to `path`.
+
+    Sessions reading the file meanwhile get either the old or the new one,
+    never a partially written file.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        write_file(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _get_sections(
+    start_date: date, end_date: date, interval: str, reference_date: date
+) -> list[tuple[date, date]]:
+    """Splits a period into sections of about one month along the plot intervals.
+
+    The intervals start at `reference_date`, the first record of the period,
+    like on the analysis page. Each section starts with the first interval
+    starting in its month, so no interval is split between two sections.
+    """
+    interval_starts = pd.date_range(
+        reference_date, end_date, freq=f"{pd.Timedelta(interval).days}D"
+    )
+    month_starts = (
+        interval_starts.to_series().groupby(interval_starts.to_period("M")).min()
+    )
+    section_starts = [start_date] + [
+        month_start.date() for month_start in month_starts.iloc[1:]
+    ]
+    section_ends = [
+        section_start - timedelta(days=1) for section_start in section_starts[1:]
+    ] + [end_date]
+    return list(zip(section_starts, section_ends))
+
+
+def _get_section_fingerprints(
+    sections: list[tuple[date, date]], df_modified: pd.DataFrame, reference_date: date
+) -> list[str]:
+    """Gets a fingerprint per section, which changes with every write to its records.
+
+    The fingerprints include the start of the intervals, which moves all
+    intervals if a record before the first one is added or deleted.
+    """
+    fingerprints = []
+    for section_start, section_end in sections:
+        modified_at = df_modified.loc[
+            (df_modified["date"] >= pd.Timestamp(section_start))
+            & (df_modified["date"] <= pd.Timestamp(section_end)),
+            "modified_at",
+        ]
+        last_modified = modified_at.max().isoformat() if len(modified_at) else ""
+        fingerprints.append(f"{reference_date}:{len(modified_at)}:{last_modified}")
+    return fingerprints
+
+
+def _render_section(
+    df_section: pd.DataFrame, interval: str, section_dir: Path
+) -> list[str]:
+    """Renders the plots of one section into `section_dir`, returns its HTML parts.
+
+    The 'date_interval' column of the section must be computed for the whole
+    period, so that the intervals match those of the other sections.
+    """
+    if df_section.empty:
+        return ["<p>Keine Einträge in diesem Zeitraum.</p>"]
+
+    writer = _SectionWriter(section_dir / "plots.pdf")
+    try:
+        create_plots(df_section, interval, out=writer)
+    finally:
+        writer.close()
+    return writer.html_parts
+
+
+def build_report(
+    start_date: date,
+    end_date: date,
+    interval: str,
+    user_id: str,
+    sql_engine: sql.Engine,
+) -> dict:
+    """Builds the report of all plots for a period, reusing unchanged sections.
+
+    The report consists of one section per month of the period, split along
+    the intervals of the plots. Rendered sections are kept by their range
+    and fingerprint, so a section is only rendered again if its records were
+    added, modified or deleted, also by the reports of other periods, e.g.
+    the one of the next day. The report files are replaced as a whole, see
+    `_replace_file`, and old reports are deleted, see `prune_reports`.
+
+    Args:
+        start_date (date): The start date of the report period.
+        end_date (date): The end date of the report period.
+        interval (str): The interval of the plots, e.g. '3days'.
+        user_id (str): The user whose diary is reported.
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+
+    Returns:
+        dict: The manifest of the report, see `get_report`.
+    """
+    report_dir = get_report_dir(start_date, end_date, interval, user_id)
+    report_dir.mkdir(parents=True, exist_ok=True)
+
+    df_modified = get_diary_modification_dates(
+        start_date, end_date, user_id, sql_engine
+    )
+    reference_date = (
+        df_modified["date"].min().date() if len(df_modified) else start_date
+    )
+    sections = _get_sections(start_date, end_date, interval, reference_date)
+    fingerprints = _get_section_fingerprints(sections, df_modified, reference_date)
+
+    df_diary = None
+    manifest_sections = {}
+    rebuilt_sections = []
+    for (section_start, section_end), fingerprint in zip(sections, fingerprints):
+        section_key = section_start.isoformat()
+        section_dir = get_section_dir(
+            section_start, section_end, interval, fingerprint, user_id
+        )
+        manifest_sections[section_key] = {
+            "end_date": section_end.isoformat(),
+            "fingerprint": fingerprint,
+            "dir": f"{interval}/{section_dir.name}",
+        }
+        if (section_dir / "section.html").exists():
+            continue
+
+        if df_diary is None:
+            # The intervals of the whole period, as on the analysis page
+            df_diary = get_df_with_interval_col(
+                get_diary_records_by_date_range(
+                    start_date, end_date, user_id, sql_engine
+                ),
+                interval=interval,
+                interval_col_name="date_interval",
+            )
+        df_section = df_diary[
+            (df_diary["date"] >= pd.Timestamp(section_start))
+            & (df_diary["date"] <= pd.Timestamp(section_end))
+        ].copy()
+
+        # Rendered aside and renamed, so a section directory is always complete
+        tmp_section_dir = section_dir.with_name(f".{section_dir.name}.tmp")
+        shutil.rmtree(tmp_section_dir, ignore_errors=True)
+        tmp_section_dir.mkdir(parents=True)
+        try:
+            html_parts = _render_section(df_section, interval, tmp_section_dir)
+            section_title = (
+                f"{section_start.strftime('%d.%m.%Y')} – "
+                f"{section_end.strftime('%d.%m.%Y')}"
+            )
+            (tmp_section_dir / "section.html").write_text(
+                f"<section><h2>{section_title}</h2>{''.join(html_parts)}</section>"
+            )
+            os.replace(tmp_section_dir, section_dir)
+        finally:
+            shutil.rmtree(tmp_section_dir, ignore_errors=True)
+        rebuilt_sections.append(section_key)
+
+    built_at = datetime.now()
+    title = (
+        f"Bericht {start_date.strftime('%d.%m.%Y')} – "
+        f"{end_date.strftime('%d.%m.%Y')} [{interval}]"
+    )
+    sections_dir = _get_user_dir(user_id) / "sections"
+    section_dirs = {
+        section_key: sections_dir / manifest_section["dir"]
+        for section_key, manifest_section in manifest_sections.items()
+    }
+    report_html = REPORT_TEMPLATE.format(
+        title=title,
+        built_at=built_at.strftime("%d.%m.%Y %H:%M"),
+        sections="\n".join(
+            (section_dir / "section.html").read_text()
+            for section_dir in section_dirs.values()
+        ),
+    )
+    _replace_file(report_dir / "report.html", lambda path: path.write_text(report_html))
+
+    def write_bundle(bundle_path: Path) -> None:
+        with zipfile.ZipFile(bundle_path, "w", zipfile.ZIP_DEFLATED) as bundle:
+            bundle.writestr("report.html", report_html)
+            for section_key, section_dir in section_dirs.items():
+                pdf_path = section_dir / "plots.pdf"
+                if pdf_path.exists():
+                    bundle.write(pdf_path, f"{section_key}.pdf")
+
+    _replace_file(report_dir / "bundle.zip", write_bundle)
+
+    manifest = {
+        "built_at": built_at.isoformat(),
+        "rebuilt_sections": rebuilt_sections,
+        "sections": manifest_sections,
+    }
+    # Written last, a report is only shown once its manifest exists
+    _replace_file(
+        report_dir / "manifest.json",
+        lambda path: path.write_text(json.dumps(manifest, indent=2)),
+    )
+
+    prune_reports(user_id)
+    return manifest
+
+
+def prune_reports(user_id: str) -> None:
+    """Deletes all but the `MAX_REPORTS_PER_USER` last built reports of a user.
+
+    Sections are deleted once no kept report contains them anymore.
+    """
+    reports_dir = _get_user_dir(user_id) / "reports"
+    manifest_paths = sorted(
+        reports_dir.glob("*/manifest.json"),
+        key=lambda manifest_path: manifest_path.stat().st_mtime,
+        reverse=True,
+    )
+    kept_section_dirs: set[str] = set()
+    for manifest_path in manifest_paths[:MAX_REPORTS_PER_USER]:
+        manifest = json.loads(manifest_path.read_text())
+        kept_section_dirs.update(
+            manifest_section["dir"]
+            for manifest_section in manifest["sections"].values()
+        )
+
+    for manifest_path in manifest_paths[MAX_REPORTS_PER_USER:]:
+        shutil.rmtree(manifest_path.parent, ignore_errors=True)
+
+    for section_dir in (_get_user_dir(user_id) / "sections").glob("*/*"):
+        if f"{section_dir.parent.name}/{section_dir.name}" not in kept_section_dirs:
+            shutil.rmtree(section_dir, ignore_errors=True)
+
+
+def get_report(
+    start_date: date, end_date: date, interval: str, user_id: str
+) -> dict | None:
+    """Gets the last finished report for a period, interval and user.
+
+    Returns:
+        dict | None: The manifest of the report with the additional keys
+            'html_path' and 'bundle_path', or None if it was never built.
+    """
+    report_dir = get_report_dir(start_date, end_date, interval, user_id)
+    manifest_path = report_dir / "manifest.json"
+    if not manifest_path.exists():
+        return None
+
+    return {
+        **json.loads(manifest_path.read_text()),
+        "html_path": report_dir / "report.html",
+        "bundle_path": report_dir / "bundle.zip",
+    }
+
+
+class ReportBuilder:
+    """Builds reports one after another in a background thread.
+
+    Builds of the same report are not queued twice, a request for a report
+    which is already being built returns the running build.
+    """
+
+    def __init__(self) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="report-builder"
+        )
+        self._lock = threading.Lock()
+        self._builds: dict[Path, Future] = {}
+
+    def submit(
+        self,
+        start_date: date,
+        end_date: date,
+        interval: str,
+        user_id: str,
+        sql_engine: sql.Engine,
+    ) -> Future:
+        """Queues the build of a report, see `build_report`."""
+        report_dir = get_report_dir(start_date, end_date, interval, user_id)
+        with self._lock:
+            build = self._builds.get(report_dir)
+            if build is None or build.done():
+                build = self._executor.submit(
+                    build_report, start_date, end_date, interval, user_id, sql_engine
+                )
+                self._builds[report_dir] = build
+            return build
+
+    def get_error(
+        self, start_date: date, end_date: date, interval: str, user_id: str
+    ) -> BaseException | None:
+        """Gets the exception of the last finished build, None if it succeeded."""
+        report_dir = get_report_dir(start_date, end_date, interval, user_id)
+        with self._lock:
+            build = self._builds.get(report_dir)
+        if build is None or not build.done():
+            return None
+        return build.exception()
+
+    def is_building(
+        self, start_date: date, end_date: date, interval: str, user_id: str
+    ) -> bool:
+        """Checks whether the report is queued or being built."""
+        report_dir = get_report_dir(start_date, end_date, interval, user_id)
+        with self._lock:
+            build = self._builds.get(report_dir)
+            return build is not None and not build.done()
+
+
+@st.cache_resource
+def get_report_builder() -> ReportBuilder:
+    """Gets the report builder of the app process."""
+    return ReportBuilder()
@@ -0,0 +1,137 @@
+import math
+import threading
+import time
+
+import sqlalchemy as sql
+from sqlalchemy.exc import SQLAlchemyError
+
+import streamlit as st
+
+from db import get_sql_engine  # type: ignore
+
+# Seconds for which a measured replication lag is reused
+LAG_CHECK_INTERVAL = 5.0
+
+REPLICA_LAG_QUERY = sql.text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
+)
+
+
+class EngineRouter:
+    """Routes queries to the primary engine or to one of the replica engines.
+
+    Writes always go to the primary. Read-only queries are distributed
+    round-robin over all replicas whose replication lag is within
+    `max_replica_lag`, and fall back to the primary if there is none.
+
+    Reads which must see a recent write (read-your-own-writes) also go to the
+    primary: explicitly via `primary`, or implicitly for `max_replica_lag`
+    seconds after the last write passed to `reader`.
+
+    Args:
+        primary (sqlalchemy.engine.Engine): Engine of the primary database.
+        replicas (list[sqlalchemy.engine.Engine]): Engines of the replicas.
+        max_replica_lag (float): Replication lag in seconds up to which
+            a replica still serves reads.
+    """
+
+    def __init__(
+        self,
+        primary: sql.Engine,
+        replicas: list[sql.Engine],
+        max_replica_lag: float = 10.0,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas
+        self.max_replica_lag = max_replica_lag
+
+        self._lock = threading.Lock()
+        self._next_replica = 0
+        self._last_write_at = -math.inf
+        self._replica_lags: dict[sql.Engine, tuple[float, float]] = {}
+
+    def writer(self) -> sql.Engine:
+        """Gets the engine for writes and remembers the time of the write."""
+        with self._lock:
+            self._last_write_at = time.monotonic()
+        return self.primary
+
+    def reader(self, last_write_at: float | None = None) -> sql.Engine:
+        """Gets an engine for read-only queries.
+
+        Args:
+            last_write_at (float | None): `time.monotonic()` of the last write
+                known to the caller, e.g. from a change notification of
+                another replica. Writes via `writer` are always considered.
+
+        Returns:
+            sqlalchemy.engine.Engine: The next replica within the tolerated lag,
+                or the primary if there is none or if a write happened less than
+                `max_replica_lag` seconds ago.
+        """
+        with self._lock:
+            last_write_at = max(self._last_write_at, last_write_at or -math.inf)
+            if time.monotonic() - last_write_at < self.max_replica_lag:
+                return self.primary
+
+            replica_order = [
+                self.replicas[(self._next_replica + offset) % len(self.replicas)]
+                for offset in range(len(self.replicas))
+            ]
+            self._next_replica += 1
+
+        for replica in replica_order:
+            if self._get_replica_lag(replica) <= self.max_replica_lag:
+                return replica
+
+        return self.primary
+
+    def _get_replica_lag(self, replica: sql.Engine) -> float:
+        """Gets the replication lag of a replica in seconds, infinite if unreachable."""
+        now = time.monotonic()
+        with self._lock:
+            checked_at, lag = self._replica_lags.get(replica, (-math.inf, math.inf))
+        if now - checked_at < LAG_CHECK_INTERVAL:
+            return lag
+
+        try:
+            with replica.connect() as conn:
+                lag = float(conn.execute(REPLICA_LAG_QUERY).scalar_one())
+        except SQLAlchemyError:
+            lag = math.inf
+
+        with self._lock:
+            self._replica_lags[replica] = (now, lag)
+        return lag
+
+
+@st.cache_resource
+def get_engine_router(db_config: dict) -> EngineRouter:
+    """Get the engine router of the app process.
+
+    Args:
+        db_config (dict): Database configuration dictionary as returned
+            by `get_postgres_uri`.
+
+    Returns:
+        EngineRouter: Router over the primary and all configured replicas.
+
+    Note:
+        Replica engines are created lazily, so that an unreachable replica
+        does not prevent the app from starting. It is skipped by `reader`
+        until it becomes reachable again.
+    """
+    return EngineRouter(
+        primary=get_sql_engine(db_config),
+        replicas=[
+            sql.create_engine(replica_uri, pool_pre_ping=True)
+            for replica_uri in db_config.get("replica_uris", [])
+        ],
+        max_replica_lag=db_config.get("max_replica_lag", 10.0),
+    )
@@ -1,8 +1,56 @@
 from datetime import date
 import streamlit as st
+from streamlit.web.server.websocket_headers import _get_websocket_headers
+
+import sqlalchemy as sql
 
 from typing import Any
 
+from db import (  # type: ignore
+    DEFAULT_USER_ID,
+    get_auth_user_header,
+    search_diary_comments,
+)
+
+
+def _get_request_header(name: str) -> str | None:
+    """Gets a header of the HTTP request of the current session, if there is one."""
+    try:
+        headers = _get_websocket_headers()
+    except RuntimeError:
+        # No server, e.g. in `AppTest`
+        return None
+    if headers is None:
+        return None
+    # Header names are case insensitive
+    return next(
+        (value for key, value in headers.items() if key.lower() == name.lower()),
+        None,
+    )
+
+
+def get_user_id() -> str:
+    """Gets the authenticated user whose diary is shown.
+
+    Returns:
+        str: The user passed by the authenticating reverse proxy in the header
+            given by `get_auth_user_header`. If no header is configured, the
+            app serves a single diary and every session is the default user.
+
+    Note:
+        Sessions without the header are rejected, the page stops with an
+        error. The user can not be chosen by the client, e.g. via the URL.
+    """
+    auth_user_header = get_auth_user_header()
+    if auth_user_header is None:
+        return DEFAULT_USER_ID
+
+    user_id = _get_request_header(auth_user_header)
+    if not user_id:
+        st.error("Nicht angemeldet. Bitte die App über die Anmeldung aufrufen.")
+        st.stop()
+    return user_id
+
 
 def get_items(current_date: date, records: dict) -> dict:
     """Gets user input items for new diary record.
@@ -83,3 +131,39 @@ def get_items(current_date: date, records: dict) -> dict:
     items["comment"] = st.text_area("Kommentar", value=items.get("comment", ""))
 
     return items
+
+
+def _jump_to_date(date_key: str, day: date) -> None:
+    st.session_state[date_key] = day
+
+
+def show_comment_search(user_id: str, sql_engine: sql.Engine, date_key: str) -> None:
+    """Shows a search over the comments of the diary in the sidebar.
+
+    Args:
+        user_id (str): The user whose comments are searched.
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+        date_key (str): Session state key of the date input of the page. A
+            click on a result sets it to the date of the result.
+    """
+    query = st.sidebar.text_input(
+        "Kommentare durchsuchen",
+        placeholder="z.B. schwindel -kopfschmerz",
+        help='Wörter mit "-" ausschließen, Phrasen in Anführungszeichen setzen',
+    )
+    if not query:
+        return
+
+    results = search_diary_comments(query, user_id, sql_engine)
+    if not results:
+        st.sidebar.write("Keine Treffer")
+
+    for result in results:
+        st.sidebar.button(
+            result["date"].strftime("%d.%m.%Y"),
+            key=f"search_result_{result['date']}",
+            on_click=_jump_to_date,
+            args=(date_key, result["date"]),
+        )
+        st.sidebar.markdown(result["snippet"])
@@ -0,0 +1,310 @@
+import io
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import date
+from typing import Callable
+
+from matplotlib.figure import Figure
+
+import sqlalchemy as sql
+
+import streamlit as st
+
+from db import (  # type: ignore
+    DEFAULT_USER_ID,
+    _get_oldest_diary_record_date,
+    get_recently_active_user_ids,
+    get_df_with_interval_col,
+)
+from diary_cache import DiaryCache  # type: ignore
+from plots import create_plots  # type: ignore
+from routing import EngineRouter  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Intervals of the analysis page, each one is a default view
+DEFAULT_INTERVALS = ["1day", "3days", "7days"]
+
+# Seconds between two scheduled refreshes of all tracked views
+REFRESH_INTERVAL = float(os.environ.get("WARMUP_REFRESH_INTERVAL", "900"))
+# Seconds to wait after a write, so that a series of writes causes one refresh
+WRITE_DEBOUNCE = 5.0
+
+# Views which are kept warm, the least recently requested are dropped first
+MAX_TRACKED_VIEWS = 20
+
+
+class RecordingWriter:
+    """Records the headings and figures of `create_plots` for a later replay.
+
+    Args:
+        before_plot (Callable[[], None] | None): Called before each heading,
+            i.e. before a plot is drawn, e.g. to let other renders go first.
+    """
+
+    def __init__(self, before_plot: Callable[[], None] | None = None) -> None:
+        self.before_plot = before_plot
+        # Headings as markdown, figures as PNG
+        self.items: list[str | bytes] = []
+
+    def write(self, markdown: str) -> None:
+        if self.before_plot is not None:
+            self.before_plot()
+        self.items.append(markdown)
+
+    def pyplot(self, figure: Figure) -> None:
+        # Same rendering as `st.pyplot`
+        png_buffer = io.BytesIO()
+        figure.savefig(png_buffer, format="png", bbox_inches="tight", dpi=200)
+        self.items.append(png_buffer.getvalue())
+
+
+def replay_plots(items: list[str | bytes]) -> None:
+    """Shows plots recorded by a `RecordingWriter` on the Streamlit page."""
+    for item in items:
+        if isinstance(item, bytes):
+            st.image(io.BytesIO(item), use_column_width=True)
+        else:
+            st.write(item)
+
+
+def warm_engine_pool(sql_engine: sql.Engine) -> None:
+    """Opens as many connections as the pool of the engine keeps open."""
+    pool_size = getattr(sql_engine.pool, "size", lambda: 1)()
+    connections = []
+    try:
+        for _ in range(pool_size):
+            conn = sql_engine.connect()
+            conn.execute(sql.text("SELECT 1"))
+            connections.append(conn)
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+class WarmupScheduler:
+    """Precomputes the default views of the analysis page in the background.
+
+    A default view is the range from the oldest record of a user until today
+    in one of the `DEFAULT_INTERVALS`, as the page shows it without any
+    input. On start the default views of the most recently active users are
+    tracked, afterwards the views plotted on the page. For each one the
+    records are loaded into the diary cache and the plots are rendered and
+    kept, so that the first visitor after a restart or a write is served like
+    any later one.
+
+    The views are refreshed every `REFRESH_INTERVAL` seconds, because they
+    end today, and `WRITE_DEBOUNCE` seconds after the diary of a user changed.
+    Plots rendered on the page go first, the scheduler waits for them before
+    each of its own plots.
+
+    Args:
+        engine_router (EngineRouter): Router of the app process.
+        diary_cache (DiaryCache): Diary cache of the app process, whose
+            invalidations trigger the refresh after writes.
+    """
+
+    def __init__(self, engine_router: EngineRouter, diary_cache: DiaryCache) -> None:
+        self.engine_router = engine_router
+        self.diary_cache = diary_cache
+
+        self._lock = threading.Lock()
+        self._renders_done = threading.Condition(self._lock)
+        self._running_renders = 0
+        self._wake_event = threading.Event()
+        # Invalidations of all users and of each user, a refresh whose user
+        # was invalidated meanwhile discards its plots
+        self._generation = 0
+        self._user_generations: dict[str, int] = {}
+        self._views: dict[tuple[str, str], float] = {}
+        self._stale_views: set[tuple[str, str]] = set()
+        self._plots: dict[tuple[str, date, date, str], list[str | bytes]] = {}
+
+        diary_cache.subscribe(self._handle_invalidation)
+
+    def start(self) -> None:
+        """Starts the scheduler in a daemon thread."""
+        threading.Thread(target=self._run, name="warmup-scheduler", daemon=True).start()
+
+    def track_view(self, user_id: str, interval: str) -> None:
+        """Keeps a default view warm, e.g. after it was plotted on the page."""
+        view = (user_id, interval)
+        with self._lock:
+            is_new = view not in self._views
+            self._views[view] = time.monotonic()
+            if is_new:
+                self._stale_views.add(view)
+            if len(self._views) > MAX_TRACKED_VIEWS:
+                oldest_view = min(self._views, key=self._views.__getitem__)
+                del self._views[oldest_view]
+                self._stale_views.discard(oldest_view)
+                for plotted_view in list(self._plots):
+                    if (plotted_view[0], plotted_view[3]) == oldest_view:
+                        del self._plots[plotted_view]
+        if is_new:
+            self._wake_event.set()
+
+    def get_plots(
+        self, start_date: date, end_date: date, interval: str, user_id: str
+    ) -> list[str | bytes] | None:
+        """Gets the rendered plots of a view, None if it is not precomputed."""
+        with self._lock:
+            return self._plots.get((user_id, start_date, end_date, interval))
+
+    @contextmanager
+    def interactive_render(self) -> Iterator[None]:
+        """Pauses the precomputation while plots are rendered on the page."""
+        with self._lock:
+            self._running_renders += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running_renders -= 1
+                self._renders_done.notify_all()
+
+    def _wait_for_interactive_renders(self) -> None:
+        with self._lock:
+            self._renders_done.wait_for(lambda: self._running_renders == 0)
+
+    def _get_generation(self, user_id: str) -> tuple[int, int]:
+        return self._generation, self._user_generations.get(user_id, 0)
+
+    def _handle_invalidation(self, user_id: str | None, day: date | None) -> None:
+        with self._lock:
+            if user_id is None or day is None:
+                self._generation += 1
+                self._plots.clear()
+                self._stale_views.update(self._views)
+            else:
+                self._user_generations[user_id] = (
+                    self._user_generations.get(user_id, 0) + 1
+                )
+                for view in list(self._plots):
+                    view_user_id, start_date, end_date, _ = view
+                    if view_user_id == user_id and start_date <= day <= end_date:
+                        del self._plots[view]
+                self._stale_views.update(
+                    view for view in self._views if view[0] == user_id
+                )
+        self._wake_event.set()
+
+    def _run(self) -> None:
+        try:
+            for sql_engine in [
+                self.engine_router.primary,
+                *self.engine_router.replicas,
+            ]:
+                warm_engine_pool(sql_engine)
+        except Exception:
+            logger.exception("Warming the connection pools failed.")
+
+        self._track_default_views()
+
+        while True:
+            with self._lock:
+                # The most recently requested views are rendered first
+                stale_views = sorted(
+                    self._stale_views,
+                    key=lambda view: self._views.get(view, 0.0),
+                    reverse=True,
+                )
+                stale_intervals: dict[str, list[str]] = {}
+                for user_id, interval in stale_views:
+                    stale_intervals.setdefault(user_id, []).append(interval)
+                self._stale_views.clear()
+
+            for user_id, intervals in stale_intervals.items():
+                try:
+                    self.refresh_views(user_id, intervals)
+                except Exception:
+                    logger.exception("Precomputing the views of %s failed.", user_id)
+
+            if self._wake_event.wait(REFRESH_INTERVAL):
+                # Let a series of writes settle before rendering again
+                time.sleep(WRITE_DEBOUNCE)
+            else:
+                with self._lock:
+                    self._stale_views.update(self._views)
+            self._wake_event.clear()
+
+    def _track_default_views(self) -> None:
+        """Tracks the default views of the most recently active users."""
+        user_count = MAX_TRACKED_VIEWS // len(DEFAULT_INTERVALS)
+        try:
+            user_ids = get_recently_active_user_ids(
+                user_count, self.engine_router.reader()
+            )
+        except Exception:
+            logger.exception("Querying the active users failed.")
+            user_ids = []
+        if not user_ids:
+            user_ids = [DEFAULT_USER_ID]
+
+        # The most recently active user is tracked last, so it is dropped last
+        for user_id in reversed(user_ids):
+            for interval in DEFAULT_INTERVALS:
+                self.track_view(user_id, interval)
+
+    def refresh_views(self, user_id: str, intervals: list[str]) -> None:
+        """Loads the records and renders the plots of default views of a user.
+
+        Args:
+            user_id (str): The user whose views are rendered.
+            intervals (list[str]): The intervals of the views.
+        """
+        with self._lock:
+            generation = self._get_generation(user_id)
+
+        sql_engine = self.engine_router.reader(
+            last_write_at=self.diary_cache.last_changed_at
+        )
+        start_date = _get_oldest_diary_record_date(user_id, sql_engine)
+        if start_date is None:
+            return
+        end_date = date.today()
+
+        df_diary = self.diary_cache.get_records_by_date_range(
+            start_date=start_date,
+            end_date=end_date,
+            user_id=user_id,
+            sql_engine=sql_engine,
+        )
+        for interval in intervals:
+            df_interval = get_df_with_interval_col(
+                df_diary.copy(), interval=interval, interval_col_name="date_interval"
+            )
+            writer = RecordingWriter(before_plot=self._wait_for_interactive_renders)
+            create_plots(df_interval, interval, out=writer)
+
+            with self._lock:
+                # A write during the rendering made the plots outdated already
+                if generation != self._get_generation(user_id):
+                    return
+                self._plots[(user_id, start_date, end_date, interval)] = writer.items
+                # Views of former days are never shown again
+                for view in list(self._plots):
+                    if view[0] == user_id and view[2] != end_date:
+                        del self._plots[view]
+
+
+@st.cache_resource
+def get_warmup_scheduler(
+    _engine_router: EngineRouter, _diary_cache: DiaryCache
+) -> WarmupScheduler:
+    """Gets the warmup scheduler of the app process, started on the first call.
+
+    Args:
+        _engine_router (EngineRouter): Router of the app process.
+        _diary_cache (DiaryCache): Diary cache of the app process.
+
+    Returns:
+        WarmupScheduler: The running scheduler.
+    """
+    scheduler = WarmupScheduler(_engine_router, _diary_cache)
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,498 @@
+import argparse
+import io
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+import sqlalchemy as sql
+from sqlalchemy.exc import SQLAlchemyError
+
+from typing import Any, Iterable
+
+from db import DEFAULT_USER_ID, get_postgres_uri, get_sql_engine  # type: ignore
+
+# Metrics which are accepted from wearable exports. Steps are expected as
+# per-sample increments, all other metrics as momentary readings.
+WEARABLE_METRICS = ("bodybattery", "heart_rate", "steps")
+
+# Diary fields which can be derived from the intraday samples
+ROLLUP_FIELDS = ("bodybattery_min", "bodybattery_max", "steps")
+
+# UTC offset at the end of a timestamp, e.g. '+02:00' or 'Z'
+TIMEZONE_OFFSET_PATTERN = r"(?:Z|[+-]\d{2}:?\d{2})$"
+
+RAW_RETENTION_DAYS = 90
+HOURLY_RETENTION_DAYS = 5 * 365
+
+
+def read_wearable_export(path: Path | str) -> pd.DataFrame:
+    """Reads an exported wearable file into a long sample DataFrame.
+
+    Args:
+        path (Path | str): Path to a CSV export. Either in wide format with a
+            `timestamp` column plus one column per metric, or in long format
+            with the columns `timestamp`, `metric` and `value`.
+
+    Returns:
+        pd.DataFrame: DataFrame with the columns `ts`, `metric` and `value`,
+            aggregated to minute resolution.
+
+    Raises:
+        ValueError: If the file has no `timestamp` column or contains
+            no known metric.
+
+    Note:
+        Timezone aware timestamps keep their local wall clock time, so that
+        daily rollups match the days of the diary.
+    """
+    df_export = pd.read_csv(path)
+
+    if "timestamp" not in df_export.columns:
+        raise ValueError("Export file must have a 'timestamp' column.")
+
+    if {"metric", "value"}.issubset(df_export.columns):
+        df_samples = df_export[["timestamp", "metric", "value"]]
+    else:
+        metric_cols = [col for col in WEARABLE_METRICS if col in df_export.columns]
+        df_samples = df_export.melt(
+            id_vars="timestamp", value_vars=metric_cols, var_name="metric"
+        )
+
+    df_samples = df_samples[df_samples["metric"].isin(WEARABLE_METRICS)].dropna()
+    if df_samples.empty:
+        raise ValueError(
+            f"Export file contains none of the metrics {', '.join(WEARABLE_METRICS)}."
+        )
+
+    # The offset changes with daylight saving time, which pandas cannot parse
+    # into one column. Dropping it keeps the local wall clock time.
+    timestamps = pd.to_datetime(
+        df_samples["timestamp"]
+        .astype("string")
+        .str.replace(TIMEZONE_OFFSET_PATTERN, "", regex=True)
+    )
+
+    df_samples = df_samples.assign(ts=timestamps.dt.floor("min"))
+
+    # Several samples within one minute: steps add up, readings are averaged
+    grouped = df_samples.groupby(["metric", "ts"])["value"]
+    df_minutes = grouped.mean().to_frame()
+    is_steps = df_minutes.index.get_level_values("metric") == "steps"
+    df_minutes.loc[is_steps, "value"] = grouped.sum()[is_steps]
+
+    return df_minutes.reset_index()[["ts", "metric", "value"]]
+
+
+def _get_month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def _get_next_month_start(day: date) -> date:
+    return (_get_month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def _get_raw_retention_start(raw_retention_days: int) -> date:
+    """Gets the first day whose minute samples are kept by the retention policy.
+
+    It is the start of the month of the cutoff, the months before it are
+    downsampled and their partitions dropped, see `apply_retention_policy`.
+    """
+    return _get_month_start(date.today() - timedelta(days=raw_retention_days))
+
+
+def _ensure_monthly_partitions(conn: sql.Connection, days: Iterable[date]) -> None:
+    """Creates the monthly partitions of `wearable_samples` for the given days."""
+    for month_start in sorted({_get_month_start(day) for day in days}):
+        partition_name = f"wearable_samples_y{month_start:%Y}m{month_start:%m}"
+        conn.execute(
+            sql.text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {partition_name}
+                PARTITION OF wearable_samples
+                FOR VALUES FROM ('{month_start}') TO ('{_get_next_month_start(month_start)}')
+                """
+            )
+        )
+
+
+def add_wearable_samples_bulk(
+    df_samples: pd.DataFrame,
+    user_id: str,
+    sql_engine: sql.Engine,
+    raw_retention_days: int = RAW_RETENTION_DAYS,
+) -> str:
+    """Bulk loads intraday samples into the wearable_samples table.
+
+    Args:
+        df_samples (pd.DataFrame): Samples with the columns `ts`, `metric`
+            and `value`, e.g. from `read_wearable_export`.
+        user_id (str): The user the samples belong to.
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+        raw_retention_days (int): Days for which minute samples are kept.
+
+    Returns:
+        str: A message indicating whether the import was successful.
+
+    Note:
+        The samples are streamed via `COPY` into a temporary staging table
+        and moved from there into the partitions, so that already imported
+        samples are skipped instead of failing the whole import.
+        Samples of months which the retention policy already downsampled
+        are skipped as well. Their partitions would be created again and
+        counted twice next to the hourly aggregates.
+    """
+    retention_start = _get_raw_retention_start(raw_retention_days)
+    is_retained = df_samples["ts"] >= pd.Timestamp(retention_start)
+    skipped_count = int((~is_retained).sum())
+    df_samples = df_samples[is_retained]
+    if df_samples.empty:
+        return f"Keine Messwerte ab dem {retention_start:%d.%m.%Y} gefunden."
+
+    csv_buffer = io.StringIO()
+    df_samples.assign(user_id=user_id)[["user_id", "ts", "metric", "value"]].to_csv(
+        csv_buffer, index=False, header=False
+    )
+    csv_buffer.seek(0)
+
+    try:
+        with sql_engine.begin() as conn:
+            _ensure_monthly_partitions(conn, df_samples["ts"].dt.date.unique())
+            conn.execute(
+                sql.text(
+                    """
+                    CREATE TEMP TABLE wearable_samples_staging
+                    (LIKE wearable_samples) ON COMMIT DROP
+                    """
+                )
+            )
+            cursor = conn.connection.cursor()
+            cursor.copy_expert(
+                "COPY wearable_samples_staging (user_id, ts, metric, value) FROM STDIN WITH (FORMAT csv)",
+                csv_buffer,
+            )
+            result = conn.execute(
+                sql.text(
+                    """
+                    INSERT INTO wearable_samples (user_id, ts, metric, value)
+                    SELECT user_id, ts, metric, value FROM wearable_samples_staging
+                    ON CONFLICT (user_id, metric, ts) DO NOTHING
+                    """
+                )
+            )
+        message = f"{result.rowcount} von {len(df_samples)} Messwerten importiert."
+        if skipped_count:
+            message += (
+                f" {skipped_count} Messwerte vor dem {retention_start:%d.%m.%Y}"
+                " übersprungen."
+            )
+        return message
+
+    except SQLAlchemyError as e:
+        return f"Datenbankfehler: {e}"
+
+
+def get_daily_rollups(
+    start_date: date, end_date: date, user_id: str, sql_engine: sql.Engine
+) -> pd.DataFrame:
+    """Aggregates the wearable samples of a date range into daily diary fields.
+
+    Args:
+        start_date (date): The start date of the range to aggregate.
+        end_date (date): The end date of the range to aggregate.
+        user_id (str): The user whose samples are aggregated.
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+
+    Returns:
+        pd.DataFrame: DataFrame indexed by date with the columns
+            `bodybattery_min`, `bodybattery_max` and `steps`.
+
+    Note:
+        Days whose raw samples were already downsampled by the retention
+        policy are aggregated from the hourly table instead.
+    """
+    rollup_stmt = sql.text(
+        """
+        WITH samples AS (
+            SELECT ts, metric, value AS min_value, value AS max_value, value AS sum_value
+            FROM wearable_samples
+            WHERE user_id = :user_id AND ts >= :start_ts AND ts < :end_ts
+            UNION ALL
+            SELECT ts, metric, min_value, max_value, sum_value
+            FROM wearable_samples_hourly
+            WHERE user_id = :user_id AND ts >= :start_ts AND ts < :end_ts
+        )
+        SELECT
+            ts::date AS date,
+            MIN(min_value) FILTER (WHERE metric = 'bodybattery') AS bodybattery_min,
+            MAX(max_value) FILTER (WHERE metric = 'bodybattery') AS bodybattery_max,
+            SUM(sum_value) FILTER (WHERE metric = 'steps') AS steps
+        FROM samples
+        GROUP BY 1
+        ORDER BY 1
+        """
+    )
+    params: dict[str, Any] = {
+        "user_id": user_id,
+        "start_ts": datetime.combine(start_date, datetime.min.time()),
+        "end_ts": datetime.combine(end_date + timedelta(days=1), datetime.min.time()),
+    }
+    with sql_engine.connect() as conn:
+        df_rollups = pd.read_sql_query(rollup_stmt, conn, params=params)
+
+    df_rollups["date"] = pd.to_datetime(df_rollups["date"]).dt.date
+    return df_rollups.set_index("date").round().astype("Int64")
+
+
+def get_daily_rollup(day: date, user_id: str, sql_engine: sql.Engine) -> dict:
+    """Gets the diary fields derived from the wearable samples of one day.
+
+    Args:
+        day (date): The day to aggregate.
+        user_id (str): The user whose samples are aggregated.
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+
+    Returns:
+        dict: The derived diary fields, only containing fields for which
+            samples exist. Empty if there are no samples for the day.
+    """
+    try:
+        df_rollups = get_daily_rollups(day, day, user_id, sql_engine)
+    except SQLAlchemyError:
+        return {}
+
+    if df_rollups.empty:
+        return {}
+
+    rollup = df_rollups.iloc[0]
+    return {
+        field: int(rollup[field]) for field in ROLLUP_FIELDS if pd.notna(rollup[field])
+    }
+
+
+def propose_diary_fields(records: dict, user_id: str, sql_engine: sql.Engine) -> dict:
+    """Fills the missing fields of a diary record with wearable rollups.
+
+    Args:
+        records (dict): Diary record as returned by `get_diary_record_by_date`.
+        user_id (str): The user the record belongs to.
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+
+    Returns:
+        dict: The diary record, with empty wearable fields proposed from
+            the intraday samples. Values entered by hand are kept.
+    """
+    for field, value in get_daily_rollup(records["date"], user_id, sql_engine).items():
+        if records.get(field) is None:
+            records[field] = value
+    return records
+
+
+def apply_daily_rollups(
+    start_date: date,
+    end_date: date,
+    user_id: str,
+    sql_engine: sql.Engine,
+    overwrite: bool = False,
+) -> str:
+    """Writes the wearable rollups into the existing diary records of a date range.
+
+    Args:
+        start_date (date): The start date of the range to update.
+        end_date (date): The end date of the range to update.
+        user_id (str): The user whose records are updated.
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+        overwrite (bool): Whether to overwrite values entered by hand.
+            Defaults to False, which only fills empty fields.
+
+    Returns:
+        str: A message indicating how many diary records were updated.
+
+    Note:
+        Days without a diary record are not created, their values are
+        proposed in the questionnaire instead.
+    """
+    df_rollups = get_daily_rollups(start_date, end_date, user_id, sql_engine)
+    if df_rollups.empty:
+        return "Keine Wearable-Daten im Zeitraum gefunden."
+
+    if overwrite:
+        set_clause = ", ".join(
+            f"{field} = COALESCE(:{field}, {field})" for field in ROLLUP_FIELDS
+        )
+    else:
+        set_clause = ", ".join(
+            f"{field} = COALESCE({field}, :{field})" for field in ROLLUP_FIELDS
+        )
+    update_stmt = sql.text(
+        f"UPDATE diary SET {set_clause} WHERE user_id = :user_id AND date = :date"
+    )
+
+    records = [
+        {
+            "user_id": user_id,
+            "date": day,
+            **{
+                field: None if pd.isna(row[field]) else int(row[field])
+                for field in ROLLUP_FIELDS
+            },
+        }
+        for day, row in df_rollups.iterrows()
+    ]
+    try:
+        with sql_engine.begin() as conn:
+            result = conn.execute(update_stmt, records)
+        return f"{result.rowcount} Tagebucheinträge aktualisiert."
+
+    except SQLAlchemyError as e:
+        return f"Datenbankfehler: {e}"
+
+
+def apply_retention_policy(
+    sql_engine: sql.Engine,
+    raw_retention_days: int = RAW_RETENTION_DAYS,
+    hourly_retention_days: int = HOURLY_RETENTION_DAYS,
+) -> str:
+    """Downsamples old minute samples to hours and drops expired data.
+
+    Applies to the samples of all users. Monthly partitions which lie
+    completely before the raw retention period are detached, aggregated
+    into `wearable_samples_hourly` and dropped. Hourly aggregates older
+    than the hourly retention period are deleted.
+
+    Args:
+        sql_engine (sqlalchemy.engine.Engine): SQLAlchemy engine instance
+            for the database
+        raw_retention_days (int): Days for which minute samples are kept.
+        hourly_retention_days (int): Days for which hourly aggregates are kept.
+
+    Returns:
+        str: A message listing the downsampled partitions.
+
+    Note:
+        Each partition is detached with `DETACH PARTITION ... CONCURRENTLY`,
+        which does not block the reads and imports of the other months, and
+        then downsampled and dropped in a transaction of its own. A detached
+        partition left behind by an interrupted run is finished by the next
+        run.
+    """
+    retention_start = _get_raw_retention_start(raw_retention_days)
+    hourly_cutoff = date.today() - timedelta(days=hourly_retention_days)
+
+    # Partitions by name, so that also detached ones of interrupted runs are found
+    partitions_stmt = sql.text(
+        """
+        SELECT child.relname, pg_inherits.inhdetachpending
+        FROM pg_class child
+        LEFT JOIN pg_inherits ON pg_inherits.inhrelid = child.oid
+        WHERE child.relkind = 'r'
+          AND child.relnamespace = current_schema()::regnamespace
+          AND child.relname ~ '^wearable_samples_y\\d{4}m\\d{2}$'
+        ORDER BY child.relname
+        """
+    )
+    downsample_stmt = """
+        INSERT INTO wearable_samples_hourly
+            (user_id, ts, metric, min_value, max_value, sum_value, sample_count)
+        SELECT user_id, date_trunc('hour', ts), metric,
+               MIN(value), MAX(value), SUM(value), COUNT(*)
+        FROM {partition_name}
+        GROUP BY 1, 2, 3
+        ON CONFLICT (user_id, metric, ts) DO NOTHING
+    """
+    detach_stmt = (
+        "ALTER TABLE wearable_samples DETACH PARTITION {partition_name} {mode}"
+    )
+
+    downsampled = []
+    try:
+        with sql_engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as detach_conn:
+            partitions = detach_conn.execute(partitions_stmt).all()
+            for partition_name, is_detach_pending in partitions:
+                month_start = datetime.strptime(
+                    partition_name.removeprefix("wearable_samples_"), "y%Ym%m"
+                ).date()
+                if month_start >= retention_start:
+                    continue
+
+                # Not allowed in a transaction block. A partition whose
+                # concurrent detach was interrupted must be finalized first.
+                if is_detach_pending is not None:
+                    mode = "FINALIZE" if is_detach_pending else "CONCURRENTLY"
+                    detach_conn.execute(
+                        sql.text(
+                            detach_stmt.format(partition_name=partition_name, mode=mode)
+                        )
+                    )
+
+                with sql_engine.begin() as conn:
+                    conn.execute(
+                        sql.text(downsample_stmt.format(partition_name=partition_name))
+                    )
+                    conn.execute(sql.text(f"DROP TABLE {partition_name}"))
+                downsampled.append(partition_name)
+
+        with sql_engine.begin() as conn:
+            conn.execute(
+                sql.text("DELETE FROM wearable_samples_hourly WHERE ts < :cutoff"),
+                {"cutoff": hourly_cutoff},
+            )
+
+    except SQLAlchemyError as e:
+        return f"Datenbankfehler: {e}"
+
+    if not downsampled:
+        return "Keine Partitionen zum Verdichten gefunden."
+    return f"Verdichtete Partitionen: {', '.join(downsampled)}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Wearable sample jobs")
+    parser.add_argument("--user", default=DEFAULT_USER_ID, help="User of the samples")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_import = subparsers.add_parser("import", help="Import exported files")
+    parser_import.add_argument("files", nargs="+", type=Path)
+
+    parser_rollup = subparsers.add_parser("rollup", help="Fill diary fields")
+    parser_rollup.add_argument("--days", type=int, default=7)
+    parser_rollup.add_argument("--overwrite", action="store_true")
+
+    parser_retention = subparsers.add_parser("retention", help="Downsample old data")
+    parser_retention.add_argument("--raw-days", type=int, default=RAW_RETENTION_DAYS)
+    parser_retention.add_argument(
+        "--hourly-days", type=int, default=HOURLY_RETENTION_DAYS
+    )
+
+    args = parser.parse_args()
+    sql_engine = get_sql_engine(get_postgres_uri())
+
+    if args.command == "import":
+        for path in args.files:
+            print(
+                f"{path}: {add_wearable_samples_bulk(read_wearable_export(path), args.user, sql_engine)}"
+            )
+    elif args.command == "rollup":
+        date_today = date.today()
+        print(
+            apply_daily_rollups(
+                date_today - timedelta(days=args.days),
+                date_today,
+                args.user,
+                sql_engine,
+                overwrite=args.overwrite,
+            )
+        )
+    elif args.command == "retention":
+        print(apply_retention_policy(sql_engine, args.raw_days, args.hourly_days))
+
+
+if __name__ == "__main__":
+    main()